@@ -1,24 +1,178 @@
-from flask import Flask, render_template, request, jsonify, Response, send_from_directory
+import time
+from modules.startup import LazyModule, startup_report
+
+_import_started = time.perf_counter()
+
+from flask import (Flask, Request, render_template, request, jsonify, Response, send_from_directory, send_file,
+                   stream_with_context)
 from flask_cors import CORS  # Add this line
+from werkzeug.exceptions import BadRequest
 import os
 import json
 import datetime
-import cv2
+import csv
+import io
+import math
+import zlib
+import base64
 import numpy as np
 import shutil
-from modules.face_recognition import FaceRecognizer
+import threading
+from modules.face_recognition import create_face_recognizer
 from modules.database import Database
+from modules.thumbnails import ThumbnailCache
+from modules.inference_pool import InferenceClient, InferencePoolBusy, InferencePoolError, merge_metrics
+from modules.sharding import ShardError
+from modules.image_decode import decode_base64_image, decode_upload, decode_stats, ImageDecodeError, ImageTooLarge
+
+# Requests up to this size keep their uploaded files in memory instead of temp files
+IN_MEMORY_UPLOAD_BYTES = int(os.environ.get('IN_MEMORY_UPLOAD_MB', 16)) * 1024 * 1024
+
+class UploadRequest(Request):
+    """Request that keeps the uploads of small requests in memory
+    
+    Werkzeug spools every upload to a SpooledTemporaryFile, which moves to disk
+    past 500 KB. Keeping the upload in a BytesIO instead lets read_upload hand
+    the decoder a view of it without copying.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= IN_MEMORY_UPLOAD_BYTES:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS for all routes
 
-face_recognizer = FaceRecognizer()
+# Reject oversized request bodies before they are read (per-image limits are in modules/image_decode.py)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 64)) * 1024 * 1024
+
+# Heavy imports and the recognizer are loaded on first use (or by warm_up)
+cv2 = LazyModule('cv2')
+_face_recognizer = None
+_face_recognizer_lock = threading.Lock()
 db = Database('attendance_db.sqlite')
+db.setup_database()  # Ensure database is set up, also when started by gunicorn
 
 # Ensure required directories exist
 os.makedirs('data/student_images', exist_ok=True)
 os.makedirs('data/models', exist_ok=True)
 
+# Default latency budget for a whole attendance request (overridable per request)
+ATTENDANCE_BUDGET_MS = float(os.environ.get('ATTENDANCE_BUDGET_MS', 3000))
+
+# Resized student images served as avatars, cached on disk with an LRU size limit
+THUMBNAIL_SIZES = [int(size) for size in os.environ.get('THUMBNAIL_SIZES', '64,128,256').split(',')]
+THUMBNAIL_CACHE_MB = int(os.environ.get('THUMBNAIL_CACHE_MB', 256))
+STUDENT_IMAGE_MAX_AGE = 3600  # Seconds browsers may reuse an image before revalidating
+
+thumbnail_cache = ThumbnailCache(
+    sizes=THUMBNAIL_SIZES,
+    max_bytes=THUMBNAIL_CACHE_MB * 1024 * 1024
+)
+
+# Run detection and recognition on the inference pool (modules/inference_pool.py) when configured
+INFERENCE_SOCKET = os.environ.get('INFERENCE_SOCKET')
+inference_client = None
+if INFERENCE_SOCKET:
+    inference_client = InferenceClient(INFERENCE_SOCKET, os.environ['INFERENCE_AUTHKEY'].encode('utf-8'))
+
+# Append incoming API requests to a corpus that loadtest.py can replay
+RECORD_REQUESTS_TO = os.environ.get('RECORD_REQUESTS_TO')
+RECORDED_ROUTES = ('/api/take_attendance', '/api/check_duplicate_face', '/api/register_student', '/api/attendance_data')
+_record_lock = threading.Lock()
+
+def get_face_recognizer():
+    """Return the shared FaceRecognizer, creating it on first use"""
+    global _face_recognizer
+    if _face_recognizer is None:
+        with _face_recognizer_lock:
+            if _face_recognizer is None:
+                with startup_report.phase('create face recognizer'):
+                    _face_recognizer = create_face_recognizer()
+    return _face_recognizer
+
+def get_inference():
+    """Return what runs detection and recognition for a request
+    
+    This is the inference pool client when INFERENCE_SOCKET is set, otherwise the
+    in-process recognizer. Training always runs in-process.
+    """
+    if inference_client is not None:
+        return inference_client
+    return get_face_recognizer()
+
+def warm_up():
+    """Import heavy modules, load the models and run them once
+    
+    Called by the gunicorn post_worker_init hook (see gunicorn.conf.py) so a
+    worker is fully warm before it takes traffic. With an inference pool the
+    pool workers warm themselves up for recognition, but training still runs
+    in-process, so the local recognizer is warmed up either way.
+    """
+    get_face_recognizer().warm_up()
+    return startup_report.as_dict()
+
+startup_report.record('import app', time.perf_counter() - _import_started)
+
+@app.before_request
+def record_request():
+    if not RECORD_REQUESTS_TO or request.path not in RECORDED_ROUTES:
+        return
+
+    entry = {'method': request.method, 'route': request.path}
+    # Every value of repeated fields (e.g. uploaded_images) is kept, as a list
+    if request.args:
+        entry['args'] = request.args.to_dict(flat=False)
+    if request.form:
+        entry['form'] = request.form.to_dict(flat=False)
+    if request.files:
+        entry['files'] = {}
+        for name, file in request.files.items(multi=True):
+            data = file.read()
+            file.seek(0)
+            entry['files'].setdefault(name, []).append(
+                {'filename': file.filename, 'data_b64': base64.b64encode(data).decode('ascii')}
+            )
+
+    with _record_lock:
+        with open(RECORD_REQUESTS_TO, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+@app.errorhandler(InferencePoolBusy)
+def inference_pool_busy(e):
+    response = jsonify({'success': False, 'message': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(400)
+def bad_request(e):
+    return jsonify({'success': False, 'message': e.description}), 400
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'success': False, 'message': 'Upload is too large'}), 413
+
+@app.errorhandler(ImageTooLarge)
+def image_too_large(e):
+    return jsonify({'success': False, 'message': str(e)}), 413
+
+@app.errorhandler(ImageDecodeError)
+def image_decode_error(e):
+    return jsonify({'success': False, 'message': str(e)}), 400
+
+@app.errorhandler(InferencePoolError)
+def inference_pool_error(e):
+    print(f"Inference pool error: {e}")
+    return jsonify({'success': False, 'message': 'Face recognition is temporarily unavailable'}), 503
+
+@app.errorhandler(ShardError)
+def shard_error(e):
+    print(f"Gallery shard error: {e}")
+    response = jsonify({'success': False, 'message': 'Face recognition is temporarily unavailable'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -36,9 +190,64 @@ def get_students():
     students = db.get_all_students()
     return jsonify(students)
 
+def is_face_box(box):
+    """Whether a value is an (x, y, width, height) list of finite numbers"""
+    return (isinstance(box, list) and len(box) == 4 and
+            all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in box))
+
+def uploaded_face_boxes():
+    """Parse the 'face_boxes' JSON list sent with face chips
+    
+    Each entry is the (x, y, width, height) of the face within the chip, or
+    null when the browser did not send one.
+    
+    Raises:
+        BadRequest: If face_boxes is not a list of such boxes
+    """
+    try:
+        boxes = json.loads(request.form.get('face_boxes', '[]'))
+    except ValueError:
+        raise BadRequest('face_boxes must be a JSON list')
+    if not isinstance(boxes, list) or not all(box is None or is_face_box(box) for box in boxes):
+        raise BadRequest('face_boxes must be a list of [x, y, width, height] boxes')
+    return boxes
+
+def uploaded_face_chips():
+    """Face chips cropped by the browser detector, sent as 'face_chips' files
+    
+    Each chip may come with the (x, y, width, height) of the face within it in
+    the 'face_boxes' JSON list, in the same order as the files.
+    
+    Returns:
+        list: (image, box, file) for each chip that could be decoded, where file
+            is the uploaded FileStorage and box is None when none was sent
+    
+    Raises:
+        BadRequest: If face_boxes is malformed
+    """
+    files = request.files.getlist('face_chips')
+    if not files:
+        return []
+    
+    boxes = uploaded_face_boxes()
+    
+    chips = []
+    for i, file in enumerate(files):
+        try:
+            image = decode_upload(file, max_side=None)
+        except ImageDecodeError as e:
+            print(f"Warning: Could not decode face chip {i}: {e}")
+            continue
+        box = boxes[i] if i < len(boxes) else None
+        chips.append((image, box, file))
+    return chips
+
 @app.route('/api/register_student', methods=['POST'])
 def register_student():
     name = request.form.get('name')
+    # Decode the browser's face chips first, so a malformed request is refused
+    # before the student is created
+    face_chips = uploaded_face_chips()
     student_id = db.add_student(name)
     
     # Save images - now supporting many images from continuous capture
@@ -58,10 +267,10 @@ def register_student():
             if image_data:
                 try:
                     # Convert base64 to image and save
-                    image = face_recognizer.base64_to_image(image_data)
+                    image = decode_base64_image(image_data)
                     
                     # Already cropped on client side, but double-check for better face detection
-                    face_image = face_recognizer.detect_and_crop_face(image)
+                    face_image = get_inference().detect_and_crop_face(image)
                     if face_image is not None:
                         cv2.imwrite(f'{save_path}/{i}.jpg', face_image)
                         images.append(face_image)
@@ -70,6 +279,8 @@ def register_student():
                         cv2.imwrite(f'{save_path}/{i}.jpg', image)
                         images.append(image)
                         print(f"Warning: No face detected in image {i}, using full image")
+                except (InferencePoolBusy, InferencePoolError):
+                    raise
                 except Exception as e:
                     print(f"Error processing image {i}: {e}")
     
@@ -78,14 +289,11 @@ def register_student():
     for i, file in enumerate(uploaded_files):
         if file.filename:
             try:
-                temp_path = f'temp_upload_{i}.jpg'
-                file.save(temp_path)
-                
-                # Read the uploaded image
-                image = cv2.imread(temp_path)
+                # Decode the uploaded image straight from the request
+                image = decode_upload(file)
                 
                 # Detect and crop face
-                face_image = face_recognizer.detect_and_crop_face(image)
+                face_image = get_inference().detect_and_crop_face(image)
                 
                 if face_image is not None:
                     # Save the cropped face
@@ -94,17 +302,44 @@ def register_student():
                     # Save the original image if no face detected
                     cv2.imwrite(f'{save_path}/{image_count + i}.jpg', image)
                     print(f"Warning: No face detected in uploaded file {i}, using full image")
-                
-                # Clean up temp file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
                     
+            except (InferencePoolBusy, InferencePoolError):
+                raise
             except Exception as e:
                 print(f"Error processing uploaded file {i}: {e}")
     
+    # Face chips cropped by the browser are saved as sent once they pass verification,
+    # and their aligned chips are kept so training does not detect the faces again
+    verified_chips = {}
+    for i, (image, box, file) in enumerate(face_chips):
+        try:
+            chip_path = f'{save_path}/chip_{i}.jpg'
+            aligned, landmarks = get_inference().verify_face_chip(image, box)
+            if aligned is not None:
+                # Copy the upload to disk as sent, without another copy in memory
+                file.stream.seek(0)
+                file.save(chip_path)
+                verified_chips[f'chip_{i}.jpg'] = (aligned, landmarks)
+                images.append(image)
+                continue
+            
+            face_image = get_inference().detect_and_crop_face(image)
+            if face_image is not None:
+                cv2.imwrite(chip_path, face_image)
+                images.append(face_image)
+            else:
+                print(f"Warning: No face found in face chip {i}, skipping it")
+        except (InferencePoolBusy, InferencePoolError):
+            raise
+        except Exception as e:
+            print(f"Error processing face chip {i}: {e}")
+    
     print(f"Registered student {name} with ID {student_id} and {len(images)} images")
     
     # Train only this new student instead of rebuilding the entire model
+    face_recognizer = get_face_recognizer()
+    if verified_chips:
+        face_recognizer.store_face_chips(student_id, verified_chips)
     encoding_count = face_recognizer.train_student(student_id)
     
     return jsonify({
@@ -119,7 +354,7 @@ def train_model():
     # Check if we're forcing a full retrain
     force_retrain = request.json.get('force_retrain', False) if request.is_json else False
     
-    encoding_count = face_recognizer.train_model(force_retrain=force_retrain)
+    encoding_count = get_face_recognizer().train_model(force_retrain=force_retrain)
     
     return jsonify({
         'success': True, 
@@ -127,9 +362,24 @@ def train_model():
         'full_retrain': force_retrain
     })
 
+def recognize_in_image(image, deadline, roster=None):
+    """Recognize every face in an attendance image within the request deadline
+    
+    When a roster is given, faces are matched against that roster's students
+    first and only unknown faces are searched in the whole gallery.
+    """
+    remaining_ms = max(0.0, (deadline - time.monotonic()) * 1000)
+    return get_inference().recognize_all_faces(image, budget_ms=remaining_ms, roster=roster)
+
 @app.route('/api/take_attendance', methods=['POST'])
 def take_attendance():
     date = request.form.get('date')
+    budget_ms = request.form.get('budget_ms', ATTENDANCE_BUDGET_MS, type=float)
+    deadline = time.monotonic() + budget_ms / 1000.0
+    
+    # Restrict matching to the section's roster when a section is named
+    section_id = request.form.get('section_id', type=int)
+    roster = db.get_section_roster(section_id) if section_id else None
     
     # Handle both captured and uploaded images
     recognized_students = []
@@ -137,48 +387,21 @@ def take_attendance():
     # Check if captured image is provided
     image_data = request.form.get('image')
     if image_data:
-        image = face_recognizer.base64_to_image(image_data)
-        
-        # For attendance, we want to detect all faces in the image
-        face_images = face_recognizer.extract_all_faces(image)
-        
-        if face_images:
-            # Process each detected face
-            for face_img in face_images:
-                students = face_recognizer.recognize_faces(face_img)
-                recognized_students.extend(students)
-        else:
-            # Fall back to the full image if no faces detected
-            students = face_recognizer.recognize_faces(image)
-            recognized_students.extend(students)
+        image = decode_base64_image(image_data)
+        recognized_students.extend(recognize_in_image(image, deadline, roster))
     
-    # Handle uploaded image similarly
+    # Handle uploaded image similarly, decoding it straight from the request
     if 'uploaded_image' in request.files:
         uploaded_file = request.files['uploaded_image']
         if uploaded_file.filename:
-            # Save temporarily
-            temp_path = 'temp_attendance.jpg'
-            uploaded_file.save(temp_path)
-            
-            # Process the image
-            image = cv2.imread(temp_path)
-            if image is not None:
-                # Extract all faces
-                face_images = face_recognizer.extract_all_faces(image)
-                
-                if face_images:
-                    # Process each detected face
-                    for face_img in face_images:
-                        students = face_recognizer.recognize_faces(face_img)
-                        recognized_students.extend(students)
-                else:
-                    # Fall back to the full image
-                    students = face_recognizer.recognize_faces(image)
-                    recognized_students.extend(students)
-            
-            # Remove temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            image = decode_upload(uploaded_file)
+            recognized_students.extend(recognize_in_image(image, deadline, roster))
+    
+    # Face chips already cropped by the browser detector skip server-side detection
+    chips = uploaded_face_chips()
+    if chips:
+        chip_pairs = [(image, box) for image, box, _ in chips]
+        recognized_students.extend(get_inference().recognize_face_chips(chip_pairs, roster=roster))
     
     # Remove duplicates
     recognized_students = list(set(recognized_students))
@@ -189,6 +412,53 @@ def take_attendance():
     
     return jsonify({'success': True, 'recognized': recognized_students})
 
+@app.route('/api/classes', methods=['GET'])
+def get_classes():
+    return jsonify(db.get_classes())
+
+@app.route('/api/classes', methods=['POST'])
+def add_class():
+    name = (request.get_json(silent=True) or {}).get('name')
+    if not name:
+        return jsonify({'success': False, 'message': 'Class name is required'}), 400
+    
+    class_id = db.add_class(name)
+    return jsonify({'success': True, 'class_id': class_id})
+
+@app.route('/api/classes/<int:class_id>/sections', methods=['POST'])
+def add_section(class_id):
+    name = (request.get_json(silent=True) or {}).get('name')
+    if not name:
+        return jsonify({'success': False, 'message': 'Section name is required'}), 400
+    
+    section_id = db.add_section(class_id, name)
+    return jsonify({'success': True, 'section_id': section_id})
+
+@app.route('/api/sections/<int:section_id>/students', methods=['GET'])
+def get_section_students(section_id):
+    return jsonify(db.get_section_roster(section_id))
+
+@app.route('/api/sections/<int:section_id>/students', methods=['PUT'])
+def set_section_students(section_id):
+    student_ids = (request.get_json(silent=True) or {}).get('student_ids', [])
+    try:
+        student_ids = [int(student_id) for student_id in student_ids]
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'student_ids must be a list of IDs'}), 400
+    
+    db.set_section_students(section_id, student_ids)
+    return jsonify({'success': True, 'student_count': len(set(student_ids))})
+
+def student_avatar_url(student_id, size=64):
+    """URL of a thumbnail of the student's first stored image, or None if there is none"""
+    student_dir = f'data/student_images/{student_id}'
+    if not os.path.isdir(student_dir):
+        return None
+    images = sorted(f for f in os.listdir(student_dir) if f.endswith(('.jpg', '.jpeg', '.png')))
+    if not images:
+        return None
+    return f'/data/student_images/{student_id}/{images[0]}?size={size}'
+
 @app.route('/api/attendance_data', methods=['GET'])
 def get_attendance_data():
     date = request.args.get('date', datetime.date.today().isoformat())
@@ -199,10 +469,81 @@ def get_attendance_data():
     for record in attendance_data:
         student_details = db.get_student_by_id(record['student_id'])
         combined = {**record, **student_details}
+        combined['avatar'] = student_avatar_url(record['student_id'])
         attendance_with_details.append(combined)
     
     return jsonify(attendance_with_details)
 
+EXPORT_COLUMNS = ['id', 'student_id', 'name', 'date', 'timestamp']
+EXPORT_FLUSH_ROWS = 500  # Rows per chunk sent to the client
+
+def export_rows(records, export_format):
+    """Serialize attendance records into text chunks of EXPORT_FLUSH_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS) if export_format == 'csv' else None
+    if writer:
+        writer.writeheader()
+    
+    rows = 0
+    for record in records:
+        if writer:
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(record) + '\n')
+        rows += 1
+        
+        if rows % EXPORT_FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks on the fly, flushing after each chunk"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/attendance_export', methods=['GET'])
+def export_attendance():
+    """Stream attendance records for a date range as CSV or NDJSON
+    
+    Query parameters: start and end (YYYY-MM-DD, inclusive), format ('csv' or
+    'ndjson') and gzip=1 to compress on the fly (also used when the client sends
+    Accept-Encoding: gzip).
+    """
+    today = datetime.date.today().isoformat()
+    start = request.args.get('start', today)
+    end = request.args.get('end', start)
+    export_format = request.args.get('format', 'csv')
+    
+    try:
+        datetime.date.fromisoformat(start)
+        datetime.date.fromisoformat(end)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end must be dates in YYYY-MM-DD format'}), 400
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': "format must be 'csv' or 'ndjson'"}), 400
+    
+    chunks = export_rows(db.iter_attendance_range(start, end), export_format)
+    headers = {
+        'Content-Disposition': f'attachment; filename=attendance_{start}_{end}.{export_format}'
+    }
+    
+    use_gzip = request.args.get('gzip') in ('1', 'true') or 'gzip' in request.headers.get('Accept-Encoding', '')
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
 @app.route('/api/reset_system', methods=['POST'])
 def reset_system():
     try:
@@ -214,6 +555,9 @@ def reset_system():
             shutil.rmtree('data/student_images')
             os.makedirs('data/student_images')
         
+        # Remove cached thumbnails
+        thumbnail_cache.clear()
+        
         # Remove trained models
         if os.path.exists('data/models'):
             shutil.rmtree('data/models')
@@ -226,26 +570,53 @@ def reset_system():
 
 @app.route('/data/student_images/<path:filename>')
 def student_images(filename):
-    return send_from_directory('data/student_images', filename)
+    """Serve a stored student image, or a cached thumbnail when ?size= is given
+    
+    Responses carry a strong ETag and Cache-Control, and conditional requests
+    are answered with 304 Not Modified.
+    """
+    size = request.args.get('size', type=int)
+    if not size:
+        return send_from_directory('data/student_images', filename, max_age=STUDENT_IMAGE_MAX_AGE)
+    
+    try:
+        thumb_path, etag = thumbnail_cache.get(filename, size)
+    except FileNotFoundError:
+        return jsonify({'success': False, 'message': 'Image not found'}), 404
+    
+    return send_file(
+        os.path.abspath(thumb_path),
+        mimetype='image/jpeg',
+        etag=etag,
+        conditional=True,
+        max_age=STUDENT_IMAGE_MAX_AGE
+    )
 
 @app.route('/api/check_duplicate_face', methods=['POST'])
 def check_duplicate_face():
     try:
-        # Get image from request
+        # Get image from request, preferring a face chip cropped by the browser
         image_data = request.form.get('image')
+        chips = uploaded_face_chips()
         
-        if not image_data:
+        if chips:
+            image, box, _ = chips[0]
+            exists, student_id = get_inference().check_face_chip_exists(image, box)
+        elif image_data:
+            # Convert base64 to image
+            image = decode_base64_image(image_data)
+            
+            # Check if face exists
+            exists, student_id = get_inference().check_face_exists(image)
+        elif request.files.get('uploaded_image') and request.files['uploaded_image'].filename:
+            image = decode_upload(request.files['uploaded_image'])
+            exists, student_id = get_inference().check_face_exists(image)
+        else:
             return jsonify({
                 'success': False,
                 'message': 'No image provided'
             })
         
-        # Convert base64 to image
-        image = face_recognizer.base64_to_image(image_data)
-        
-        # Check if face exists
-        exists, student_id = face_recognizer.check_face_exists(image)
-        
         if exists and student_id:
             # Get student details
             student = db.get_student_by_id(student_id)
@@ -257,7 +628,7 @@ def check_duplicate_face():
                 print(f"Warning: Face recognized with ID {student_id} but no matching student record found")
                 
                 # Retrain the model to remove this face encoding
-                face_recognizer.train_model()
+                get_face_recognizer().train_model()
                 
                 return jsonify({
                     'success': True,
@@ -276,6 +647,8 @@ def check_duplicate_face():
                 'success': True,
                 'exists': False
             })
+    except (InferencePoolBusy, InferencePoolError, ShardError, ImageDecodeError, BadRequest):
+        raise  # Answered with 503, 413 or 400 by the error handlers
     except Exception as e:
         print(f"Error checking duplicate face: {e}")
         return jsonify({
@@ -283,6 +656,28 @@ def check_duplicate_face():
             'message': str(e)
         })
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    # Don't force the recognizer to load just to report on it
+    snapshots = [_face_recognizer.get_metrics()] if _face_recognizer is not None else []
+    if inference_client is not None:
+        # Detection and matching run in the pool workers, so their counters matter most
+        try:
+            snapshots.append(inference_client.metrics())
+        except InferencePoolError as e:
+            print(f"Could not read inference pool metrics: {e}")
+    metrics = merge_metrics(snapshots)
+    metrics.update(decode_stats)
+    return jsonify(metrics)
+
+@app.route('/api/warmup', methods=['POST'])
+def warmup_endpoint():
+    return jsonify({'success': True, 'startup': warm_up()})
+
+@app.route('/api/startup_report', methods=['GET'])
+def get_startup_report():
+    return jsonify(startup_report.as_dict())
+
 # Add this route to serve the React app in production
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -292,5 +687,4 @@ def serve(path):
     return send_from_directory('frontend/build', 'index.html')
 
 if __name__ == '__main__':
-    db.setup_database()  # Ensure database is set up
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
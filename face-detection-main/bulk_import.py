@@ -0,0 +1,312 @@
+"""Offline bulk enrollment and attendance for the Smart Attendance System
+
+Walks a directory tree, fans detection and encoding out over all CPU cores and
+writes the results in batched transactions. Progress is checkpointed so an
+interrupted run resumes where it stopped when the same command is run again.
+
+Run from the project directory (the same place as app.py):
+
+    python bulk_import.py enroll /archive/students
+    python bulk_import.py attendance /archive/classroom_photos --date 2024-09-02
+
+For enrollment every directory that directly contains images is one student,
+named after the directory. For attendance the date of each photo is taken from
+--date, otherwise from a YYYY-MM-DD component of its path, otherwise from the
+file modification time.
+
+At most max_images_per_student images per student are enrolled, picked the same
+way as in training. The model is saved every --save-every seconds and at the
+end, and images are only checkpointed once the model holding them is saved.
+
+A running app.py process keeps its own copy of the model in memory, so restart
+it after an enrollment run to pick up the new students.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+
+from modules.face_recognition import FaceRecognizer
+from modules.database import Database
+from modules.image_decode import decode_image_file, ImageDecodeError
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DATE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+# Recognizer owned by each pool worker process, created once by _init_worker
+_worker_recognizer = None
+
+
+def _init_worker():
+    global _worker_recognizer
+    _worker_recognizer = FaceRecognizer()
+
+
+def _enroll_task(path):
+    """Encode the face in one enrollment image (runs in a worker process)"""
+    return path, _worker_recognizer.encode_image_file(path)
+
+
+def _attendance_task(path):
+    """Recognize every face in one attendance photo (runs in a worker process)"""
+    try:
+        image = decode_image_file(path)
+        return path, _worker_recognizer.recognize_faces(image)
+    except ImageDecodeError as e:
+        print(f"Warning: Could not read image {path}: {e}")
+        return path, []
+    except Exception as e:
+        print(f"Error processing {path}: {e}")
+        return path, []
+
+
+class Checkpoint:
+    """Append-only log of processed images and created students
+
+    Each line is a JSON object, either {"paths": [...]} for a committed batch or
+    {"student_dir": ..., "student_id": ...} for a student created during enrollment.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.students = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial line from an interrupted write
+                        continue
+                    if 'student_dir' in entry:
+                        self.students[entry['student_dir']] = entry['student_id']
+                    else:
+                        self.done.update(entry.get('paths', []))
+            print(f"Resuming from checkpoint {path}: {len(self.done)} images already processed")
+
+    def _append(self, entries):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_students(self, students):
+        """Record newly created students as a {student_dir: student_id} dict"""
+        self._append({'student_dir': d, 'student_id': i} for d, i in students.items())
+        self.students.update(students)
+
+    def record_paths(self, paths):
+        """Record a committed batch of processed image paths"""
+        self._append([{'paths': paths}])
+        self.done.update(paths)
+
+
+class ThroughputStats:
+    """Tracks and prints processing throughput"""
+
+    def __init__(self, total, report_every=5.0):
+        self.total = total
+        self.report_every = report_every
+        self.processed = 0
+        self.faces = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def update(self, images, faces):
+        self.processed += images
+        self.faces += faces
+        if time.time() - self.last_report >= self.report_every:
+            self.report()
+
+    def report(self, final=False):
+        self.last_report = time.time()
+        elapsed = self.last_report - self.start_time
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        if final:
+            print(f"Processed {self.processed} images ({self.faces} faces) in {elapsed:.1f} seconds "
+                  f"- {rate:.1f} images/s")
+        else:
+            remaining = (self.total - self.processed) / rate if rate > 0 else 0.0
+            print(f"Processed {self.processed}/{self.total} images ({self.faces} faces) "
+                  f"- {rate:.1f} images/s, ETA {remaining:.0f} seconds")
+
+
+def collect_images(root):
+    """Return the absolute paths of all images under root in a stable order"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.abspath(os.path.join(dirpath, filename)))
+    return paths
+
+
+def cap_images_per_student(paths, recognizer):
+    """Keep only the images each student directory would be trained on"""
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+    return [
+        os.path.join(directory, filename)
+        for directory, filenames in by_dir.items()
+        for filename in recognizer.select_training_images(filenames)
+    ]
+
+
+def default_checkpoint_path(mode, root):
+    """Checkpoint file for a mode and input directory under data/checkpoints"""
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:12]
+    return f'data/checkpoints/{mode}-{digest}.jsonl'
+
+
+def run_pool(pending, task, flush, workers, batch_size, stats):
+    """Fan task out over a process pool and hand results to flush in batches"""
+    with multiprocessing.Pool(processes=workers, initializer=_init_worker) as pool:
+        batch = []
+        for result in pool.imap_unordered(task, pending, chunksize=4):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                stats.update(len(batch), flush(batch))
+                batch = []
+        if batch:
+            stats.update(len(batch), flush(batch))
+
+
+def enroll(args, db, checkpoint, recognizer):
+    # Sources already in the model, e.g. saved just before an interrupted run checkpointed them
+    trained_sources = set(source for source in recognizer.known_face_sources if source)
+    unsaved = {'paths': [], 'sources': [], 'saved_at': time.time()}
+
+    def save():
+        """Save the model, then checkpoint the images it now holds"""
+        if unsaved['sources']:
+            recognizer.record_images(unsaved['sources'])
+            recognizer.save_model()
+            recognizer.save_trained_students()
+            recognizer.save_image_manifest()
+        if unsaved['paths']:
+            checkpoint.record_paths(unsaved['paths'])
+        unsaved['paths'], unsaved['sources'] = [], []
+        unsaved['saved_at'] = time.time()
+
+    def flush(batch):
+        # Create students for directories that produced their first encoding
+        new_dirs = sorted({
+            os.path.dirname(path) for path, encoding in batch
+            if encoding is not None and os.path.dirname(path) not in checkpoint.students
+        })
+        if new_dirs:
+            student_ids = db.add_students([os.path.basename(d) for d in new_dirs])
+            checkpoint.record_students(dict(zip(new_dirs, student_ids)))
+
+        faces = 0
+        for path, encoding in batch:
+            if encoding is None:
+                continue
+            student_id = checkpoint.students[os.path.dirname(path)]
+            source = f'{student_id}/{os.path.basename(path)}'
+            if source in trained_sources:
+                continue
+
+            # Keep a copy of the image so later retraining works as usual
+            save_path = f'data/student_images/{student_id}'
+            os.makedirs(save_path, exist_ok=True)
+            shutil.copy2(path, os.path.join(save_path, os.path.basename(path)))
+
+            recognizer.add_student_encodings(student_id, [encoding], [source])
+            trained_sources.add(source)
+            unsaved['sources'].append(source)
+            faces += 1
+
+        unsaved['paths'].extend(path for path, _ in batch)
+        if time.time() - unsaved['saved_at'] >= args.save_every:
+            save()
+        return faces
+
+    return _enroll_task, flush, save
+
+
+def attendance(args, db, checkpoint):
+    root = os.path.abspath(args.root)
+
+    def date_for(path):
+        if args.date:
+            return args.date
+        match = DATE_PATTERN.search(os.path.relpath(path, root))
+        if match:
+            return match.group(1)
+        return datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+    def flush(batch):
+        records = []
+        for path, student_ids in batch:
+            date = date_for(path)
+            timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+            for student_id in set(student_ids):
+                records.append((int(student_id), date, timestamp))
+
+        db.mark_attendance_bulk(records)
+        checkpoint.record_paths([path for path, _ in batch])
+        return len(records)
+
+    def finish():
+        # Every batch is committed and checkpointed as soon as it is flushed
+        pass
+
+    return _attendance_task, flush, finish
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk enrollment and attendance from image directories')
+    parser.add_argument('mode', choices=['enroll', 'attendance'])
+    parser.add_argument('root', help='Directory tree of images to process')
+    parser.add_argument('--date', help='Attendance date (YYYY-MM-DD) for every photo')
+    parser.add_argument('--db', default='attendance_db.sqlite', help='SQLite database path')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--batch-size', type=int, default=500, help='Images per database transaction')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: under data/checkpoints)')
+    parser.add_argument('--save-every', type=float, default=60.0, help='Seconds between model saves when enrolling')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+
+    os.makedirs('data/student_images', exist_ok=True)
+    os.makedirs('data/models', exist_ok=True)
+
+    db = Database(args.db)
+    db.setup_database()
+
+    checkpoint = Checkpoint(args.checkpoint or default_checkpoint_path(args.mode, args.root))
+    paths = collect_images(args.root)
+    if args.mode == 'enroll':
+        recognizer = FaceRecognizer()
+        paths = cap_images_per_student(paths, recognizer)
+        task, flush, finish = enroll(args, db, checkpoint, recognizer)
+    else:
+        task, flush, finish = attendance(args, db, checkpoint)
+
+    pending = [path for path in paths if path not in checkpoint.done]
+    print(f"Found {len(paths)} images, {len(pending)} left to process with {args.workers} workers")
+
+    stats = ThroughputStats(len(pending))
+    try:
+        run_pool(pending, task, flush, args.workers, args.batch_size, stats)
+    except KeyboardInterrupt:
+        print("Interrupted. Run the same command again to resume from the last saved batch.")
+    finish()
+    stats.report(final=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -200,7 +200,10 @@ const Attendance = () => {
               {attendanceList.map((record) => (
                 <tr key={record.id}>
                   <td>{record.student_id}</td>
-                  <td>{record.name}</td>
+                  <td>
+                    {record.avatar && <img className="avatar" src={record.avatar} alt="" loading="lazy" />}
+                    {record.name}
+                  </td>
                   <td>{formatTime(record.timestamp)}</td>
                 </tr>
               ))}
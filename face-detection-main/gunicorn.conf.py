@@ -0,0 +1,15 @@
+# Gunicorn configuration for production deployment:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# Heavy imports and the face models load lazily, so each worker warms itself up
+# here before it starts accepting requests.
+
+bind = '0.0.0.0:5000'
+
+
+def post_worker_init(worker):
+    from app import warm_up
+
+    report = warm_up()
+    worker.log.info("Worker warmed up in %.2f seconds", report['total_seconds'])
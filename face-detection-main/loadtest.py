@@ -0,0 +1,361 @@
+"""Load generator for the Smart Attendance System API
+
+Replays a corpus of requests against a running server at a target request rate
+(open loop) or concurrency (closed loop) and reports latency percentiles,
+throughput and error rates per route. Uses only the standard library and runs
+fully offline against a local server.
+
+A corpus is a JSON-lines file, one request per line:
+
+    {"method": "POST", "route": "/api/take_attendance",
+     "form": {"date": "2024-09-02", "image": {"image_file": "photos/class.jpg"}},
+     "files": {"uploaded_image": {"path": "photos/class.jpg"}}}
+
+Form values given as {"image_file": path} are sent as base64 data URLs like the
+browser does. Files are given as {"path": ...} or inline as {"filename": ...,
+"data_b64": ...}. A list of values sends the field once per value, as
+recorded for repeated fields like uploaded_images. Relative paths are resolved
+against the corpus file.
+
+Build a synthetic corpus from a directory of face images:
+
+    python loadtest.py synth --images samples/ --out corpus.jsonl
+
+or record real traffic by starting the server with RECORD_REQUESTS_TO=corpus.jsonl.
+Then replay it:
+
+    python loadtest.py run corpus.jsonl --rate 20 --duration 60
+    python loadtest.py run corpus.jsonl --concurrency 8 --requests 500
+
+Register requests create real students, so run load tests against a scratch
+copy of the data directory and database.
+"""
+import argparse
+import base64
+import datetime
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROUTES = {
+    'take_attendance': '/api/take_attendance',
+    'check_duplicate_face': '/api/check_duplicate_face',
+    'register_student': '/api/register_student',
+    'attendance_data': '/api/attendance_data',
+}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_corpus(path):
+    """Load a corpus and resolve its image references into request bodies"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    file_cache = {}
+
+    def read(file_path):
+        file_path = os.path.join(base_dir, file_path)
+        if file_path not in file_cache:
+            with open(file_path, 'rb') as f:
+                file_cache[file_path] = f.read()
+        return file_cache[file_path]
+
+    requests = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+
+            form = {}
+            for name, values in entry.get('form', {}).items():
+                form[name] = []
+                for value in values if isinstance(values, list) else [values]:
+                    if isinstance(value, dict) and 'image_file' in value:
+                        data = base64.b64encode(read(value['image_file'])).decode('ascii')
+                        value = f'data:image/jpeg;base64,{data}'
+                    form[name].append(str(value))
+
+            files = {}
+            for name, values in entry.get('files', {}).items():
+                files[name] = []
+                for value in values if isinstance(values, list) else [values]:
+                    if 'path' in value:
+                        files[name].append((os.path.basename(value['path']), read(value['path'])))
+                    else:
+                        files[name].append((value.get('filename', 'upload.jpg'), base64.b64decode(value['data_b64'])))
+
+            requests.append({
+                'method': entry.get('method', 'GET'),
+                'route': entry['route'],
+                'args': entry.get('args', {}),
+                'body': encode_body(form, files),
+            })
+    return requests
+
+
+def encode_body(form, files):
+    """Encode form fields and files as (body, content_type), or None for no body
+
+    form maps each name to a list of values and files each name to a list of
+    (filename, data) pairs, so repeated fields are sent once per value.
+    """
+    if not form and not files:
+        return None
+    if not files:
+        return urllib.parse.urlencode(form, doseq=True).encode('utf-8'), 'application/x-www-form-urlencoded'
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, values in form.items():
+        for value in values:
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            )
+    for name, uploads in files.items():
+        for filename, data in uploads:
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+            )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Results:
+    """Collects per-route latencies and errors from concurrent requests"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, latency, status, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(latency)
+            self.statuses.setdefault(route, {})
+            self.statuses[route][status] = self.statuses[route].get(status, 0) + 1
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    @staticmethod
+    def percentile(sorted_values, fraction):
+        """Nearest-rank percentile of an already sorted list"""
+        if not sorted_values:
+            return 0.0
+        index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+        return sorted_values[index]
+
+    def summary(self, elapsed):
+        routes = {}
+        all_latencies = []
+        total_errors = 0
+        for route, latencies in sorted(self.latencies.items()):
+            values = sorted(latencies)
+            all_latencies.extend(values)
+            errors = self.errors.get(route, 0)
+            total_errors += errors
+            routes[route] = self._stats(values, errors, elapsed)
+            routes[route]['statuses'] = {str(k): v for k, v in sorted(self.statuses[route].items(), key=str)}
+        overall = self._stats(sorted(all_latencies), total_errors, elapsed)
+        return {'elapsed_seconds': round(elapsed, 3), 'overall': overall, 'routes': routes}
+
+    def _stats(self, values, errors, elapsed):
+        count = len(values)
+        return {
+            'requests': count,
+            'errors': errors,
+            'error_rate': round(errors / count, 4) if count else 0.0,
+            'throughput_rps': round(count / elapsed, 2) if elapsed > 0 else 0.0,
+            'p50_ms': round(self.percentile(values, 0.50) * 1000, 1),
+            'p95_ms': round(self.percentile(values, 0.95) * 1000, 1),
+            'p99_ms': round(self.percentile(values, 0.99) * 1000, 1),
+            'max_ms': round(values[-1] * 1000, 1) if values else 0.0,
+        }
+
+
+def send(base_url, request, timeout):
+    """Send one request and return (status, ok)"""
+    url = base_url.rstrip('/') + request['route']
+    if request['args']:
+        url += '?' + urllib.parse.urlencode(request['args'], doseq=True)
+
+    data, headers = None, {}
+    if request['body'] is not None:
+        data, headers['Content-Type'] = request['body']
+
+    http_request = urllib.request.Request(url, data=data, headers=headers, method=request['method'])
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        return e.code, False
+    except Exception as e:
+        return type(e).__name__, False
+
+    # The API reports some failures as 200 with success: false
+    ok = 200 <= status < 300
+    if ok and body[:1] == b'{':
+        try:
+            ok = json.loads(body).get('success', True) is not False
+        except ValueError:
+            pass
+    return status, ok
+
+
+def run_open_loop(corpus, base_url, rate, duration, timeout, max_in_flight, results):
+    """Start requests at a fixed rate regardless of how fast the server answers
+
+    Latency is measured from each request's scheduled start, so time spent
+    waiting for a free client slot counts against the server.
+    """
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    requests = itertools.cycle(corpus)
+
+    def timed(request, scheduled):
+        status, ok = send(base_url, request, timeout)
+        results.record(request['route'], time.perf_counter() - scheduled, status, ok)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(timed, next(requests), scheduled)
+
+
+def run_closed_loop(corpus, base_url, concurrency, total, timeout, results):
+    """Keep a fixed number of requests in flight until total requests are done"""
+    requests = itertools.cycle(corpus)
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if next(counter) >= total:
+                    return
+                request = next(requests)
+            started = time.perf_counter()
+            status, ok = send(base_url, request, timeout)
+            results.record(request['route'], time.perf_counter() - started, status, ok)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def print_summary(summary):
+    print(f"\nCompleted in {summary['elapsed_seconds']:.1f} seconds")
+    header = f"{'route':<32}{'requests':>9}{'errors':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    rows = list(summary['routes'].items()) + [('overall', summary['overall'])]
+    for route, stats in rows:
+        print(f"{route:<32}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput_rps']:>8}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+
+def synthesize(args):
+    """Write a synthetic corpus mixing the main routes over a directory of images"""
+    images = sorted(
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(args.images)
+        for filename in filenames if filename.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not images:
+        raise SystemExit(f"No images found under {args.images}")
+
+    mix = {}
+    for part in args.mix.split(','):
+        name, weight = part.split('=')
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown route in mix: {name} (choose from {', '.join(ROUTES)})")
+        mix[name] = float(weight)
+
+    out_dir = os.path.dirname(os.path.abspath(args.out))
+    rng = random.Random(args.seed)
+    today = datetime.date.today().isoformat()
+
+    with open(args.out, 'w') as f:
+        for i in range(args.count):
+            name = rng.choices(list(mix), weights=list(mix.values()))[0]
+            image = {'image_file': os.path.relpath(os.path.abspath(rng.choice(images)), out_dir)}
+            entry = {'method': 'POST', 'route': ROUTES[name]}
+            if name == 'take_attendance':
+                entry['form'] = {'date': today, 'image': image}
+            elif name == 'check_duplicate_face':
+                entry['form'] = {'image': image}
+            elif name == 'register_student':
+                entry['form'] = {'name': f'Load Test {i}', 'image_count': 1, 'image_0': image}
+            else:
+                entry = {'method': 'GET', 'route': ROUTES[name], 'args': {'date': today}}
+            f.write(json.dumps(entry) + '\n')
+    print(f"Wrote {args.count} requests to {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Smart Attendance System API')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Replay a corpus against a server')
+    run.add_argument('corpus', help='JSON-lines request corpus')
+    run.add_argument('--base-url', default='http://127.0.0.1:5000')
+    run.add_argument('--rate', type=float, help='Open loop: requests per second')
+    run.add_argument('--duration', type=float, default=60, help='Open loop: seconds to run')
+    run.add_argument('--max-in-flight', type=int, default=256, help='Open loop: client concurrency limit')
+    run.add_argument('--concurrency', type=int, default=4, help='Closed loop: concurrent clients')
+    run.add_argument('--requests', type=int, default=200, help='Closed loop: total requests')
+    run.add_argument('--timeout', type=float, default=60, help='Per-request timeout in seconds')
+    run.add_argument('--json', help='Also write the summary as JSON to this file')
+
+    synth = subparsers.add_parser('synth', help='Generate a synthetic corpus from a directory of images')
+    synth.add_argument('--images', required=True, help='Directory of face or classroom images')
+    synth.add_argument('--out', required=True, help='Corpus file to write')
+    synth.add_argument('--count', type=int, default=1000, help='Number of requests')
+    synth.add_argument('--mix', default='take_attendance=50,check_duplicate_face=30,attendance_data=15,register_student=5',
+                       help='Relative weight of each route')
+    synth.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == 'synth':
+        synthesize(args)
+        return
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        raise SystemExit(f"Corpus {args.corpus} is empty")
+
+    results = Results()
+    start = time.perf_counter()
+    if args.rate:
+        print(f"Open loop: {args.rate} requests/s for {args.duration} seconds against {args.base_url}")
+        run_open_loop(corpus, args.base_url, args.rate, args.duration, args.timeout, args.max_in_flight, results)
+    else:
+        print(f"Closed loop: {args.concurrency} clients, {args.requests} requests against {args.base_url}")
+        run_closed_loop(corpus, args.base_url, args.concurrency, args.requests, args.timeout, results)
+
+    summary = results.summary(time.perf_counter() - start)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
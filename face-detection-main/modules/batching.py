@@ -0,0 +1,115 @@
+import threading
+import time
+
+class _PendingMatch:
+    """Probe faces submitted by one caller, waiting for their batch to be scored"""
+
+    def __init__(self, encodings, roster):
+        self.encodings = list(encodings)
+        self.roster = roster
+        self.roster_key = frozenset(str(student_id) for student_id in roster) if roster else None
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MatchBatcher:
+    """Collects probe faces from concurrent requests and scores them together
+
+    The first probe to arrive opens a window of window_ms. Everything submitted
+    before the window closes (or until max_batch probes are waiting) is scored
+    against the gallery in one matrix operation per roster, and the results are
+    handed back to the waiting callers. A caller therefore waits at most about
+    window_ms longer than it would have on its own.
+
+    Args:
+        score_batch: Function (probes, roster) -> [(index, distance), ...], normally
+            FaceRecognizer.score_batch
+        window_ms: How long to collect probes before scoring them
+        max_batch: Score immediately once this many probes are waiting
+    """
+
+    def __init__(self, score_batch, window_ms=5.0, max_batch=256):
+        self.score_batch = score_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.batches = 0
+        self.probes = 0
+        self._pending = []
+        self._pending_probes = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def match(self, encodings, roster=None):
+        """Match encodings, batched with those of concurrent callers
+
+        Returns:
+            list: (index, distance) for each encoding, as returned by score_batch
+        """
+        if len(encodings) == 0:
+            return []
+
+        pending = _PendingMatch(encodings, roster)
+        with self._condition:
+            self._pending.append(pending)
+            self._pending_probes += len(pending.encodings)
+            self._condition.notify()
+
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.results
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+                # Keep collecting until the window closes or the batch is full
+                deadline = time.monotonic() + self.window
+                while self._pending_probes < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._pending
+                self._pending = []
+                self._pending_probes = 0
+
+            self._score(batch)
+
+    def _score(self, batch):
+        # Callers searching the same gallery or roster share one matrix operation
+        groups = {}
+        for pending in batch:
+            groups.setdefault(pending.roster_key, []).append(pending)
+
+        for group in groups.values():
+            try:
+                probes = [encoding for pending in group for encoding in pending.encodings]
+                results = self.score_batch(probes, group[0].roster)
+
+                # Scatter the results back to each caller in order
+                offset = 0
+                for pending in group:
+                    pending.results = results[offset:offset + len(pending.encodings)]
+                    offset += len(pending.encodings)
+
+                self.batches += 1
+                self.probes += len(probes)
+            except Exception as e:
+                for pending in group:
+                    pending.error = e
+            finally:
+                for pending in group:
+                    pending.done.set()
+
+    def get_stats(self):
+        return {
+            'match_batches': self.batches,
+            'match_batch_probes': self.probes,
+            'match_batch_mean_size': self.probes / self.batches if self.batches else 0.0
+        }
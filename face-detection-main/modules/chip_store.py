@@ -0,0 +1,77 @@
+import os
+import numpy as np
+
+class ChipStore:
+    """Packed per-student store of aligned face chips and the landmarks used to align them
+
+    Each student gets one compressed .npz file holding, for every source image,
+    the 150x150 landmark-aligned chip that dlib's encoder works on, the 5-point
+    landmarks and the source file's modification time. Images in which no face
+    was found are remembered too, so they are not re-detected on every retrain.
+
+    Chips are stored losslessly so encodings computed from them match encodings
+    computed from the original images.
+    """
+
+    def __init__(self, root='data/models/face_chips', chip_size=150, padding=0.25):
+        self.root = root
+        self.chip_size = chip_size
+        self.padding = padding
+
+    def path(self, student_id):
+        return os.path.join(self.root, f'{student_id}.npz')
+
+    def load(self, student_id):
+        """Load a student's chips
+
+        Returns:
+            dict: source filename -> (mtime, chip, landmarks), with chip and
+                landmarks set to None for images where no face was found
+        """
+        path = self.path(student_id)
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            with np.load(path) as data:
+                entries = {}
+                for source, mtime, chip, landmarks in zip(data['sources'], data['mtimes'], data['chips'], data['landmarks']):
+                    entries[str(source)] = (float(mtime), chip, landmarks)
+                for source, mtime in zip(data['miss_sources'], data['miss_mtimes']):
+                    entries[str(source)] = (float(mtime), None, None)
+                return entries
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading face chips for student {student_id}: {e}")
+            return {}
+
+    def save(self, student_id, entries):
+        """Write a student's chips, replacing any previous file atomically"""
+        hits = sorted((source, entry) for source, entry in entries.items() if entry[1] is not None)
+        misses = sorted((source, entry[0]) for source, entry in entries.items() if entry[1] is None)
+
+        if hits:
+            chips = np.stack([entry[1] for _, entry in hits]).astype(np.uint8)
+            landmarks = np.stack([entry[2] for _, entry in hits]).astype(np.int32)
+        else:
+            chips = np.zeros((0, self.chip_size, self.chip_size, 3), dtype=np.uint8)
+            landmarks = np.zeros((0, 5, 2), dtype=np.int32)
+
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(student_id)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                sources=np.array([source for source, _ in hits], dtype=str),
+                mtimes=np.array([entry[0] for _, entry in hits], dtype=np.float64),
+                chips=chips,
+                landmarks=landmarks,
+                miss_sources=np.array([source for source, _ in misses], dtype=str),
+                miss_mtimes=np.array([mtime for _, mtime in misses], dtype=np.float64)
+            )
+        os.replace(temp_path, path)
+
+    def remove(self, student_id):
+        path = self.path(student_id)
+        if os.path.exists(path):
+            os.remove(path)
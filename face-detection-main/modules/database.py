@@ -38,6 +38,38 @@ class Database:
             )
         ''')
         
+        # Index attendance by date for per-day lookups and date-range exports
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)")
+        
+        # Create classes table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS classes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL
+            )
+        ''')
+        
+        # Create sections table - a section is one taught group (session) of a class
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                class_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                FOREIGN KEY (class_id) REFERENCES classes (id)
+            )
+        ''')
+        
+        # Create section roster table linking students to sections
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS section_students (
+                section_id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                FOREIGN KEY (section_id) REFERENCES sections (id),
+                FOREIGN KEY (student_id) REFERENCES students (id),
+                PRIMARY KEY (section_id, student_id)
+            )
+        ''')
+        
         conn.commit()
         conn.close()
     
@@ -49,6 +81,9 @@ class Database:
             cursor = conn.cursor()
             
             # Drop all tables
+            cursor.execute("DROP TABLE IF EXISTS section_students")
+            cursor.execute("DROP TABLE IF EXISTS sections")
+            cursor.execute("DROP TABLE IF EXISTS classes")
             cursor.execute("DROP TABLE IF EXISTS attendance")
             cursor.execute("DROP TABLE IF EXISTS students")
             
@@ -80,6 +115,29 @@ class Database:
         
         return student_id
     
+    def add_students(self, names):
+        """Add several students in a single transaction and return their IDs"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        today = datetime.date.today().isoformat()
+        student_ids = []
+        try:
+            for name in names:
+                cursor.execute(
+                    "INSERT INTO students (name, registration_date) VALUES (?, ?)",
+                    (name, today)
+                )
+                student_ids.append(cursor.lastrowid)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return student_ids
+    
     def get_student_by_id(self, student_id):
         """Get student details by ID"""
         conn = self.get_connection()
@@ -118,6 +176,36 @@ class Database:
         conn.close()
         return success
     
+    def mark_attendance_bulk(self, records):
+        """Mark attendance for many students in a single transaction
+        
+        Args:
+            records: Iterable of (student_id, date, timestamp) tuples. A timestamp
+                of None is replaced with the current time.
+        
+        Returns:
+            int: Number of records written
+        """
+        now = datetime.datetime.now().isoformat()
+        rows = [(student_id, date, timestamp or now) for student_id, date, timestamp in records]
+        if not rows:
+            return 0
+        
+        conn = self.get_connection()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO attendance (student_id, date, timestamp) VALUES (?, ?, ?)",
+                rows
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return len(rows)
+    
     def get_all_students(self):
         """Get all registered students"""
         conn = self.get_connection()
@@ -144,4 +232,114 @@ class Database:
         attendance = [dict(row) for row in cursor.fetchall()]
         
         conn.close()
-        return attendance
\ No newline at end of file
+        return attendance
+    
+    def iter_attendance_range(self, start_date, end_date, batch_size=1000):
+        """Yield attendance records between two dates (inclusive) without loading them all
+        
+        Rows are read from a server-side cursor in batches of batch_size, so memory
+        use does not depend on the size of the range. The connection stays open
+        until the generator is exhausted or closed.
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT a.id, a.student_id, s.name, a.date, a.timestamp
+                FROM attendance a
+                JOIN students s ON a.student_id = s.id
+                WHERE a.date BETWEEN ? AND ?
+                ORDER BY a.date, a.timestamp
+            ''', (start_date, end_date))
+            
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+    
+    def add_class(self, name):
+        """Add a new class and return its ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("INSERT INTO classes (name) VALUES (?)", (name,))
+        
+        class_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        
+        return class_id
+    
+    def add_section(self, class_id, name):
+        """Add a new section to a class and return its ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "INSERT INTO sections (class_id, name) VALUES (?, ?)",
+            (class_id, name)
+        )
+        
+        section_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        
+        return section_id
+    
+    def get_classes(self):
+        """Get all classes with their sections"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, name FROM classes ORDER BY name")
+        classes = [dict(row, sections=[]) for row in cursor.fetchall()]
+        by_id = {cls['id']: cls for cls in classes}
+        
+        cursor.execute('''
+            SELECT s.id, s.class_id, s.name, COUNT(ss.student_id) AS student_count
+            FROM sections s
+            LEFT JOIN section_students ss ON ss.section_id = s.id
+            GROUP BY s.id
+            ORDER BY s.name
+        ''')
+        for row in cursor.fetchall():
+            section = dict(row)
+            if section['class_id'] in by_id:
+                by_id[section['class_id']]['sections'].append(section)
+        
+        conn.close()
+        return classes
+    
+    def set_section_students(self, section_id, student_ids):
+        """Replace the roster of a section with the given student IDs"""
+        conn = self.get_connection()
+        try:
+            conn.execute("DELETE FROM section_students WHERE section_id = ?", (section_id,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO section_students (section_id, student_id) VALUES (?, ?)",
+                [(section_id, student_id) for student_id in student_ids]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def get_section_roster(self, section_id):
+        """Get the IDs of the students enrolled in a section"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "SELECT student_id FROM section_students WHERE section_id = ?",
+            (section_id,)
+        )
+        roster = [row['student_id'] for row in cursor.fetchall()]
+        
+        conn.close()
+        return roster
@@ -1,35 +1,209 @@
 import os
-import cv2
 import numpy as np
 import pickle
-import face_recognition
-import base64
 from io import BytesIO
 import time
-import dlib  # Add dlib import
 import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from modules.startup import LazyModule, startup_report
+from modules.chip_store import ChipStore
+from modules.image_decode import decode_base64_image, ImageDecodeError
+from modules.sharding import ShardCoordinator, ShardError
+
+# Heavy imports are deferred until first use so importing this module stays cheap
+cv2 = LazyModule('cv2')
+face_recognition = LazyModule('face_recognition')
+dlib = LazyModule('dlib')
+
+
+class FallbackPolicy:
+    """Decides whether the upsample-2 HOG detection retry is worth its cost
+    
+    The retry is only run when its estimated cost fits in the remaining latency
+    budget and it has historically recovered faces often enough to pay off. The
+    cost is estimated from timings of earlier retries. Until there are any, it is
+    estimated as cost_factor times the cost of a HOG first pass, since the retry
+    does roughly four times its pixel work. CNN first passes on the GPU say
+    nothing about HOG cost and are not used.
+    """
+    
+    def __init__(self, cost_factor=4.0, min_hit_rate=0.1, warmup_attempts=20, explore_every=20):
+        self.cost_factor = cost_factor
+        self.min_hit_rate = min_hit_rate
+        self.warmup_attempts = warmup_attempts
+        self.explore_every = explore_every
+        self.seconds_per_megapixel = None  # Moving average of HOG first-pass detection cost
+        self.retry_seconds_per_megapixel = None  # Moving average of measured retry cost
+        self.attempts = 0
+        self.hits = 0
+        self.skipped = 0
+        self._low_yield_count = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _average(current, pixels, seconds):
+        sample = seconds / (pixels / 1e6)
+        return sample if current is None else 0.9 * current + 0.1 * sample
+    
+    def record_first_pass(self, pixels, seconds):
+        """Update the cost estimate from the timing of a HOG first pass"""
+        if pixels <= 0:
+            return
+        with self._lock:
+            self.seconds_per_megapixel = self._average(self.seconds_per_megapixel, pixels, seconds)
+    
+    def estimated_retry_seconds(self, pixels):
+        """Expected cost of a retry on an image of the given size, or None if unknown"""
+        if self.retry_seconds_per_megapixel is not None:
+            return self.retry_seconds_per_megapixel * (pixels / 1e6)
+        if self.seconds_per_megapixel is not None:
+            return self.seconds_per_megapixel * (pixels / 1e6) * self.cost_factor
+        return None
+    
+    def hit_rate(self):
+        """Smoothed fraction of retries that found a face"""
+        return (self.hits + 1) / (self.attempts + 2)
+    
+    def should_retry(self, pixels, remaining_seconds=None):
+        """Decide whether to run the retry for an image of the given size
+        
+        Args:
+            pixels: Number of pixels in the image passed to the detector
+            remaining_seconds: Time left in the request budget, or None for no budget
+        """
+        with self._lock:
+            # Never start a retry that is expected to blow the budget
+            if remaining_seconds is not None:
+                if remaining_seconds <= 0:
+                    self.skipped += 1
+                    return False
+                estimated = self.estimated_retry_seconds(pixels)
+                if estimated is not None:
+                    if estimated > remaining_seconds:
+                        self.skipped += 1
+                        return False
+            
+            # Always retry until there is enough history to judge the hit rate
+            if self.attempts < self.warmup_attempts or self.hit_rate() >= self.min_hit_rate:
+                return True
+            
+            # Occasionally retry anyway so the hit rate can recover if inputs change
+            self._low_yield_count += 1
+            if self._low_yield_count % self.explore_every == 0:
+                return True
+            self.skipped += 1
+            return False
+    
+    def record_retry(self, found_faces, pixels=0, seconds=None):
+        """Record the outcome of a retry and, when given, its timing"""
+        with self._lock:
+            self.attempts += 1
+            if found_faces:
+                self.hits += 1
+            if pixels > 0 and seconds is not None:
+                self.retry_seconds_per_megapixel = self._average(self.retry_seconds_per_megapixel, pixels, seconds)
+    
+    def get_stats(self):
+        return {
+            'fallback_attempts': self.attempts,
+            'fallback_hits': self.hits,
+            'fallback_hit_rate': self.hits / self.attempts if self.attempts else 0.0,
+            'fallback_skipped': self.skipped
+        }
+
 
 class FaceRecognizer:
-    def __init__(self, model_path='data/models/face_model.pkl', metadata_path='data/models/trained_students.json'):
+    def __init__(self, model_path='data/models/face_model.pkl', metadata_path='data/models/trained_students.json',
+                 manifest_path='data/models/image_manifest.json', load_gallery=True):
         self.model_path = model_path
         self.metadata_path = metadata_path
+        self.manifest_path = manifest_path
         self.known_face_encodings = []
         self.known_face_names = []
+        self.known_face_sources = []  # Image ('student_id/file_name') each encoding came from
         self.trained_students = set()  # Keep track of trained student IDs
+        self.image_manifest = None  # Source -> size, mtime and hash of every trained image
+        self.max_images_per_student = 20  # Limit images per student for faster training
+        self._model_mtime = None  # Modification time of the model file last loaded or saved
+        self._warmed_up = False
+        # False in processes that never train and search shards, which then
+        # neither load nor hold the encodings
+        self.load_gallery = load_gallery
+        
+        # Held while training, storing chips and saving the model, trained students
+        # and manifest, so request threads never change or write them concurrently
+        self._model_lock = threading.RLock()
+        
+        # Aligned face chips per student, so retraining can skip face detection
+        self.chip_store = ChipStore(os.path.join(os.path.dirname(self.model_path), 'face_chips'))
+        
+        # Cached (N, 128) matrix of the known encodings, rebuilt when the gallery changes
+        self._gallery_version = 0
+        self._gallery_cache = None
+        self._gallery_cache_key = None
+        
+        # Per-roster sub-galleries for class/section scoped matching, least recently used first
+        self._roster_cache = OrderedDict()
+        self._roster_cache_size = 32
+        self._roster_lock = threading.Lock()
+        self.roster_stats = {'roster_matches': 0, 'global_fallbacks': 0}
+        
+        # Optional MatchBatcher that scores faces from concurrent requests together
+        self.match_batcher = None
+        
+        # Optional ShardCoordinator that searches a gallery partitioned across shard servers
+        self.shard_coordinator = None
+        
+        # Tiered duplicate check: a cheap pass first, escalating to the expensive
+        # settings only when the best match lands close to the threshold
+        self.match_threshold = 0.5
+        self.escalation_band = 0.08
+        self.duplicate_check_stats = {'checks': 0, 'escalations': 0}
+        
+        # Face chips cropped by the browser detector that passed or failed verification
+        self.chip_stats = {'chips_accepted': 0, 'chips_rejected': 0}
+        
+        # Learned policy for the detection retry in recognize_faces
+        self.fallback_policy = FallbackPolicy()
         
         # Create model directory if it doesn't exist
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
         
-        self.load_model()
-        self.load_trained_students()
+        if self.load_gallery:
+            with startup_report.phase('load face model'):
+                self.load_model()
+                self.load_trained_students()
+                self.load_image_manifest()
         
         # Check for GPU availability
-        self.use_gpu = dlib.DLIB_USE_CUDA and dlib.cuda.get_num_devices() > 0
+        with startup_report.phase('probe CUDA devices'):
+            self.use_gpu = dlib.DLIB_USE_CUDA and dlib.cuda.get_num_devices() > 0
         if self.use_gpu:
             print(f"GPU acceleration available. Using {dlib.cuda.get_num_devices()} CUDA device(s)")
         else:
             print("GPU acceleration not available. Using CPU only")
     
+    def warm_up(self):
+        """Load the detection and encoding models and run them once on a blank image
+        
+        Call this before the process takes traffic so the first request does not
+        pay for imports, model loading and first-call initialisation. Only the
+        first call does any work.
+        """
+        if self._warmed_up:
+            return
+        with startup_report.phase('warm up models'):
+            blank = np.zeros((64, 64, 3), dtype=np.uint8)
+            cv2.cvtColor(blank, cv2.COLOR_RGB2BGR)
+            face_recognition.face_locations(blank, model='hog', number_of_times_to_upsample=1)
+            face_recognition.face_encodings(blank, [(8, 56, 56, 8)], num_jitters=1, model="small")
+            if self.shard_coordinator is None:
+                self.gallery_matrix()
+        self._warmed_up = True
+    
     def load_model(self):
         """Load the trained model if it exists"""
         if os.path.exists(self.model_path):
@@ -37,7 +211,39 @@ class FaceRecognizer:
                 data = pickle.load(f)
                 self.known_face_encodings = data['encodings']
                 self.known_face_names = data['names']
-                print(f"Loaded model with {len(self.known_face_encodings)} face encodings")
+                # Models saved before per-image tracking have no sources
+                self.known_face_sources = data.get('sources') or [None] * len(self.known_face_names)
+                self._gallery_version += 1
+            self._model_mtime = os.path.getmtime(self.model_path)
+            print(f"Loaded model with {len(self.known_face_encodings)} face encodings")
+    
+    def reload_if_changed(self):
+        """Reload the model if another process has saved a newer one
+        
+        Returns:
+            bool: True if the model was reloaded
+        """
+        if not self.load_gallery:
+            return False
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            mtime = None  # Model removed, e.g. by a system reset
+        
+        if mtime == self._model_mtime:
+            return False
+        
+        self.known_face_encodings = []
+        self.known_face_names = []
+        self.known_face_sources = []
+        self.trained_students = set()
+        self._gallery_version += 1
+        self._model_mtime = None
+        
+        self.load_model()
+        self.load_trained_students()
+        self.load_image_manifest()
+        return True
     
     def load_trained_students(self):
         """Load the set of already trained student IDs"""
@@ -59,247 +265,624 @@ class FaceRecognizer:
     def save_trained_students(self):
         """Save the set of trained student IDs to persistent storage"""
         os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
-        with open(self.metadata_path, 'w') as f:
+        with self._model_lock, open(self.metadata_path, 'w') as f:
             json.dump({
                 'trained_students': list(self.trained_students),
                 'last_updated': time.strftime('%Y-%m-%d %H:%M:%S')
             }, f)
     
+    def load_image_manifest(self):
+        """Load the per-image manifest, or leave it as None if there is none yet"""
+        self.image_manifest = None
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    self.image_manifest = json.load(f).get('images', {})
+            except Exception as e:
+                print(f"Error loading image manifest: {e}")
+    
+    def save_image_manifest(self):
+        """Save the per-image manifest to persistent storage"""
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        with self._model_lock, open(self.manifest_path, 'w') as f:
+            json.dump({
+                'images': self.image_manifest or {},
+                'last_updated': time.strftime('%Y-%m-%d %H:%M:%S')
+            }, f)
+    
+    def _file_hash(self, path):
+        """SHA-1 of a file's contents"""
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _ensure_image_manifest(self):
+        """Create the manifest for a model trained before per-image tracking existed
+        
+        The images of already-trained students are recorded as up to date, so they
+        are not encoded a second time.
+        """
+        if self.image_manifest is not None:
+            return
+        
+        self.image_manifest = {}
+        trained = [source for source in self.scan_student_images() if source.split('/', 1)[0] in self.trained_students]
+        if trained:
+            print(f"No image manifest found, recording {len(trained)} images of trained students")
+            self.record_images(trained)
+    
+    def record_images(self, sources):
+        """Record the current size, mtime and hash of images in the manifest
+        
+        The encodings each image produced are found through known_face_sources.
+        
+        Args:
+            sources: Image sources as 'student_id/file_name'
+        """
+        with self._model_lock:
+            self._ensure_image_manifest()
+            
+            for source in sources:
+                path = f'data/student_images/{source}'
+                try:
+                    stat = os.stat(path)
+                    self.image_manifest[source] = {
+                        'size': stat.st_size,
+                        'mtime': stat.st_mtime,
+                        'sha1': self._file_hash(path)
+                    }
+                except OSError:
+                    self.image_manifest.pop(source, None)
+    
     def save_model(self):
         """Save the current model state"""
-        os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-        with open(self.model_path, 'wb') as f:
-            pickle.dump({
-                'encodings': self.known_face_encodings,
-                'names': self.known_face_names
-            }, f)
+        model_dir = os.path.dirname(self.model_path)
+        os.makedirs(model_dir, exist_ok=True)
+        with self._model_lock:
+            # Write a uniquely named file next to the model and swap it in, so pool
+            # workers reloading on mtime never read a half-written pickle
+            fd, temp_path = tempfile.mkstemp(dir=model_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump({
+                        'encodings': self.known_face_encodings,
+                        'names': self.known_face_names,
+                        'sources': self.known_face_sources
+                    }, f)
+                os.replace(temp_path, self.model_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            self._gallery_version += 1
+            self._model_mtime = os.path.getmtime(self.model_path)
+            if self.shard_coordinator is not None:
+                try:
+                    self.shard_coordinator.sync(self.known_face_names, self.known_face_encodings)
+                except ShardError as e:
+                    # The model file is saved; the next save or restart sends what the shards missed
+                    print(f"Warning: Could not update gallery shards: {e}")
         print(f"Model saved with {len(self.known_face_encodings)} face encodings")
     
-    def train_student(self, student_id):
-        """Train model for a single student and update the main model
+    def extract_face_chip(self, rgb_image):
+        """Detect the first face and return its landmark-aligned chip
+        
+        The chip is the normalized crop dlib's encoder works on, so encoding it
+        with encode_face_chip gives the same result as face_encodings with the
+        small landmark model.
         
         Args:
-            student_id: ID of the student to train
+            rgb_image: Image (numpy array) in RGB format
             
         Returns:
-            int: Number of face encodings extracted for this student
+            tuple: (chip, landmarks) or (None, None) if no face was found
         """
-        # Convert to string for consistent comparison
-        student_id = str(student_id)
+        # Use HOG face detector which is CPU-friendly
+        face_locations = face_recognition.face_locations(
+            rgb_image, 
+            model='hog',
+            number_of_times_to_upsample=1
+        )
         
-        # Skip if student is already trained
-        if student_id in self.trained_students:
-            print(f"Student {student_id} is already trained. Skipping.")
-            return 0
+        # If no face found, try again with higher upsample
+        if not face_locations:
+            face_locations = face_recognition.face_locations(
+                rgb_image,
+                model='hog',
+                number_of_times_to_upsample=2
+            )
+        
+        if not face_locations:
+            return None, None
+        
+        top, right, bottom, left = face_locations[0]
+        shape = face_recognition.api.pose_predictor_5_point(rgb_image, dlib.rectangle(left, top, right, bottom))
+        chip = dlib.get_face_chip(rgb_image, shape, size=self.chip_store.chip_size, padding=self.chip_store.padding)
+        landmarks = np.array([(point.x, point.y) for point in shape.parts()], dtype=np.int32)
+        return chip, landmarks
+    
+    def extract_face_chip_file(self, img_path):
+        """Load an image file and return its aligned face chip and landmarks
+        
+        Returns:
+            tuple: (chip, landmarks) or (None, None) if the image could not be read or has no face
+        """
+        try:
+            # Load image
+            image = cv2.imread(img_path)
             
-        print(f"Training model for student {student_id}...")
-        start_time = time.time()
+            # Skip invalid images
+            if image is None:
+                print(f"Warning: Could not read image {img_path}")
+                return None, None
+            
+            # Convert BGR to RGB (face_recognition uses RGB)
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            return self.extract_face_chip(rgb_image)
+        except Exception as e:
+            print(f"Error processing {img_path}: {e}")
+            return None, None
+    
+    def encode_face_chip(self, chip, num_jitters=1):
+        """Encode an aligned face chip without running detection
+        
+        Keep jitters low for CPU.
+        """
+        return np.array(face_recognition.api.face_encoder.compute_face_descriptor(chip, num_jitters))
+    
+    def encode_image_file(self, img_path):
+        """Detect and encode the first face in an image file using training settings
         
+        Args:
+            img_path: Path to the image file
+            
+        Returns:
+            The face encoding, or None if the image could not be read or has no face
+        """
+        chip, _ = self.extract_face_chip_file(img_path)
+        if chip is None:
+            return None
+        return self.encode_face_chip(chip)
+    
+    def student_image_files(self, student_id):
+        """List the image files stored for a student"""
         student_dir = f'data/student_images/{student_id}'
         if not os.path.isdir(student_dir):
+            return []
+        return [f for f in os.listdir(student_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
+    
+    def encode_images(self, student_id, image_files):
+        """Encode some of a student's stored images
+        
+        Aligned face chips are kept in chip_store, so images that were processed
+        before go straight to encoding and only new or changed images are run
+        through face detection.
+        
+        Args:
+            student_id: ID of the student
+            image_files: File names within the student's image directory
+            
+        Returns:
+            list: (source, encoding) pairs, where source is 'student_id/file_name'
+        """
+        student_dir = f'data/student_images/{student_id}'
+        chips = self.chip_store.load(student_id)
+        chips_changed = False
+        
+        student_encodings = []
+        for img_file in image_files:
+            img_path = f'{student_dir}/{img_file}'
+            try:
+                mtime = os.path.getmtime(img_path)
+            except OSError:
+                continue
+            
+            entry = chips.get(img_file)
+            if entry is None or entry[0] != mtime:
+                # New or changed image - detect and align it once
+                chip, landmarks = self.extract_face_chip_file(img_path)
+                entry = (mtime, chip, landmarks)
+                chips[img_file] = entry
+                chips_changed = True
+            
+            chip = entry[1]
+            if chip is not None:
+                student_encodings.append((f'{student_id}/{img_file}', self.encode_face_chip(chip)))
+        
+        # Forget chips of images that have been deleted
+        for img_file in list(chips):
+            if not os.path.exists(f'{student_dir}/{img_file}'):
+                del chips[img_file]
+                chips_changed = True
+        
+        if chips_changed:
+            self.chip_store.save(student_id, chips)
+        
+        return student_encodings
+    
+    def store_face_chips(self, student_id, chips):
+        """Record aligned chips that are already known for a student's saved images
+        
+        Used for face chips verified with verify_face_chip on upload, so training
+        encodes them straight from chip_store instead of running face detection
+        on the saved files.
+        
+        Args:
+            student_id: ID of the student
+            chips: File name within the student's image directory -> (chip, landmarks)
+        """
+        student_dir = f'data/student_images/{student_id}'
+        # Training reads and rewrites the same chip file, so don't run alongside it
+        with self._model_lock:
+            entries = self.chip_store.load(student_id)
+            for img_file, (chip, landmarks) in chips.items():
+                try:
+                    entries[img_file] = (os.path.getmtime(f'{student_dir}/{img_file}'), chip, landmarks)
+                except OSError:
+                    continue
+            self.chip_store.save(student_id, entries)
+    
+    def encode_student_images(self, student_id):
+        """Encode the stored images of a single student
+        
+        Args:
+            student_id: ID of the student
+            
+        Returns:
+            list: (source, encoding) pairs extracted from the student's images
+        """
+        if not os.path.isdir(f'data/student_images/{student_id}'):
             print(f"No directory found for student {student_id}")
-            return 0
+            return []
         
         # Get image files
-        image_files = [f for f in os.listdir(student_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
+        image_files = self.student_image_files(student_id)
         
         if not image_files:
             print(f"No images found for student {student_id}")
-            return 0
+            return []
         
-        # Limit images per student for faster training
-        max_images_per_student = 20
+        return self.encode_images(student_id, self.select_training_images(image_files))
+    
+    def select_training_images(self, image_files):
+        """Pick the images a student is trained on
         
-        if len(image_files) > max_images_per_student:
+        At most max_images_per_student are used, evenly spread over the files in
+        name order, so full, incremental and bulk training all pick the same ones.
+        """
+        image_files = sorted(image_files)
+        if len(image_files) > self.max_images_per_student:
             # Use a subset with even distribution
-            image_files = image_files[::len(image_files) // max_images_per_student][:max_images_per_student]
+            step = len(image_files) // self.max_images_per_student
+            image_files = image_files[::step][:self.max_images_per_student]
+        return image_files
+    
+    def add_student_encodings(self, student_id, encodings, sources=None):
+        """Add encodings for a student to the in-memory model and mark them trained
         
-        # Process all images for this student
-        student_encodings = []
+        Args:
+            student_id: ID of the student
+            encodings: Face encodings to add
+            sources: Optional 'student_id/file_name' of the image each encoding came from
         
-        for img_file in image_files:
-            img_path = f'{student_dir}/{img_file}'
-            try:
-                # Load image
-                image = cv2.imread(img_path)
-                
-                # Skip invalid images
-                if image is None:
-                    print(f"Warning: Could not read image {img_path}")
-                    continue
-                    
-                # Convert BGR to RGB (face_recognition uses RGB)
-                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                
-                # Use HOG face detector which is CPU-friendly
-                face_locations = face_recognition.face_locations(
-                    rgb_image, 
-                    model='hog',
-                    number_of_times_to_upsample=1
-                )
-                
-                # If no face found, try again with higher upsample
-                if not face_locations:
-                    face_locations = face_recognition.face_locations(
-                        rgb_image,
-                        model='hog',
-                        number_of_times_to_upsample=2
-                    )
-                
-                # Keep jitters low for CPU
-                num_jitters = 1
-                
-                # Get face encodings
-                face_encodings = face_recognition.face_encodings(
-                    rgb_image,
-                    face_locations,
-                    num_jitters=num_jitters,
-                    model="small"  # Use small model for faster processing
-                )
-                
-                # If a face was found, add it to our training data
-                if face_encodings:
-                    student_encodings.append(face_encodings[0])
-            except Exception as e:
-                print(f"Error processing {img_path}: {e}")
+        The caller is responsible for calling save_model and save_trained_students.
+        """
+        student_id = str(student_id)
+        self.known_face_encodings.extend(encodings)
+        self.known_face_names.extend([student_id] * len(encodings))
+        self.known_face_sources.extend(sources if sources is not None else [None] * len(encodings))
+        self.trained_students.add(student_id)
+    
+    def train_student(self, student_id):
+        """Train model for a single student and update the main model
+        
+        The model is reloaded first if another process has saved a newer one, so
+        students trained there are not overwritten.
+        
+        Args:
+            student_id: ID of the student to train
+            
+        Returns:
+            int: Number of face encodings extracted for this student
+        """
+        with self._model_lock:
+            self.reload_if_changed()
+            return self._train_student(student_id)
+    
+    def _train_student(self, student_id):
+        """Train one student into the current model, with _model_lock held"""
+        # Convert to string for consistent comparison
+        student_id = str(student_id)
+        
+        # Skip if student is already trained
+        if student_id in self.trained_students:
+            print(f"Student {student_id} is already trained. Skipping.")
+            return 0
+            
+        print(f"Training model for student {student_id}...")
+        start_time = time.time()
+        
+        student_encodings = self.encode_student_images(student_id)
+        
+        # Record every image of the student so retrain_changed_images skips them
+        self.record_images(f'{student_id}/{f}' for f in self.student_image_files(student_id))
         
         # If we have encodings for this student
         if student_encodings:
-            # Add to the main model
-            self.known_face_encodings.extend(student_encodings)
-            self.known_face_names.extend([student_id] * len(student_encodings))
-            
-            # Mark the student as trained
-            self.trained_students.add(student_id)
+            # Add to the main model and mark the student as trained
+            self.add_student_encodings(
+                student_id,
+                [encoding for _, encoding in student_encodings],
+                [source for source, _ in student_encodings]
+            )
             
-            # Save the updated model and trained students list
+            # Save the updated model, trained students list and image manifest
             self.save_model()
             self.save_trained_students()
+            self.save_image_manifest()
             
             total_time = time.time() - start_time
             print(f"Added {len(student_encodings)} encodings for student {student_id} in {total_time:.2f} seconds")
             return len(student_encodings)
         
+        self.save_image_manifest()
         return 0
     
     def train_model(self, force_retrain=False):
         """Train facial recognition model using saved student images
         
+        Like train_student, this first picks up a model saved by another process.
+        
         Args:
-            force_retrain: If True, reprocess all students even if already trained
+            force_retrain: If True, reprocess all students from scratch. Otherwise
+                only images added, changed or deleted since they were last trained
+                are processed (see retrain_changed_images).
         
         Returns:
             int: Total number of face encodings in the model
         """
+        with self._model_lock:
+            self.reload_if_changed()
+            return self._train_model(force_retrain)
+    
+    def _train_model(self, force_retrain):
+        """Retrain the current model, with _model_lock held"""
+        if not force_retrain:
+            return self.retrain_changed_images()
+        
         import concurrent.futures
         
         start_time = time.time()
         print("Starting face recognition model training...")
+        print("Forcing full retraining of model (processing all students)")
         
-        # If force retrain, clear existing data
-        if force_retrain:
-            print("Forcing full retraining of model (processing all students)")
-            encodings = []
-            names = []
-            self.trained_students = set()  # Reset the trained students set
-        else:
-            # Keep existing encodings and only add new students
-            encodings = self.known_face_encodings.copy()
-            names = self.known_face_names.copy()
-            print(f"Incremental training: only processing new students. Currently have {len(encodings)} encodings.")
+        # Clear existing data
+        encodings = []
+        names = []
+        sources = []
+        self.trained_students = set()  # Reset the trained students set
+        self.image_manifest = {}
         
         # Get all student directories
         try:
-            student_dirs = os.listdir('data/student_images')
+            students_to_process = os.listdir('data/student_images')
         except FileNotFoundError:
             os.makedirs('data/student_images', exist_ok=True)
-            student_dirs = []
-            
-        total_students = len(student_dirs)
+            students_to_process = []
+        
         processed_students = 0
         new_encodings = 0
         
-        # Function to process a single student's images (reusing existing code)
-        def process_student(student_id):
-            # Skip already trained students unless force_retrain is True
-            if student_id in self.trained_students and not force_retrain:
-                return [], []
-                
-            student_encodings = []
-            student_dir = f'data/student_images/{student_id}'
-            if not os.path.isdir(student_dir):
-                return [], []
-                
-            # Get image files
-            image_files = [f for f in os.listdir(student_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
-            
-            # ... existing code for processing images ...
+        def collect(student_id, student_encodings):
+            encodings.extend(encoding for _, encoding in student_encodings)
+            sources.extend(source for source, _ in student_encodings)
+            names.extend([student_id] * len(student_encodings))
             
-            # Return all encodings for this student
-            return student_encodings, [student_id] * len(student_encodings)
+            # Add to trained students if we got encodings
+            if student_encodings:
+                self.trained_students.add(str(student_id))
+            self.record_images(f'{student_id}/{f}' for f in self.student_image_files(student_id))
+        
+        if students_to_process:
+            print(f"Processing {len(students_to_process)} students")
         
         try:
-            # Process only untrained students (or all if force_retrain)
-            students_to_process = []
-            for student_id in student_dirs:
-                if student_id not in self.trained_students or force_retrain:
-                    students_to_process.append(student_id)
-            
-            if not students_to_process:
-                print("No new students to train!")
-                return len(encodings)
-            
-            print(f"Processing {len(students_to_process)} students out of {total_students} total")
-            
             # Process students in parallel with CPU-friendly settings
             max_workers = 4  # Good balance for most systems
             
             with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [executor.submit(process_student, student_id) for student_id in students_to_process]
+                futures = {
+                    executor.submit(self.encode_student_images, student_id): student_id
+                    for student_id in students_to_process
+                }
                 
                 # Collect results as they complete
                 for future in concurrent.futures.as_completed(futures):
-                    student_encodings, student_ids = future.result()
-                    encodings.extend(student_encodings)
-                    names.extend(student_ids)
+                    student_encodings = future.result()
+                    collect(futures[future], student_encodings)
                     new_encodings += len(student_encodings)
                     processed_students += 1
                     
-                    # Add to trained students if we got encodings
-                    if student_encodings and student_ids:
-                        self.trained_students.add(str(student_ids[0]))
-                    
                     # Print progress update
                     print(f"Processed {processed_students}/{len(students_to_process)} students ({new_encodings} new face encodings)")
         
         except Exception as e:
             print(f"Error in parallel processing: {e}")
             # Fall back to sequential processing
+            encodings, names, sources = [], [], []
+            self.trained_students = set()
+            self.image_manifest = {}
             for student_id in students_to_process:
-                student_encodings, student_ids = process_student(student_id)
-                encodings.extend(student_encodings)
-                names.extend(student_ids)
-                if student_encodings and student_ids:
-                    self.trained_students.add(str(student_ids[0]))
+                collect(student_id, self.encode_student_images(student_id))
         
         # Save the trained model
         self.known_face_encodings = encodings
         self.known_face_names = names
+        self.known_face_sources = sources
         self.save_model()
         self.save_trained_students()
+        self.save_image_manifest()
         
         # Calculate training time
         total_time = time.time() - start_time
         print(f"Training completed in {total_time:.2f} seconds with {len(encodings)} total face encodings")
-        print(f"Added {new_encodings} new encodings to the model")
         
         return len(encodings)
     
+    def scan_student_images(self):
+        """Map the source of every stored image ('student_id/file_name') to its path"""
+        images = {}
+        try:
+            student_dirs = os.listdir('data/student_images')
+        except FileNotFoundError:
+            return images
+        
+        for student_id in student_dirs:
+            for img_file in self.student_image_files(student_id):
+                images[f'{student_id}/{img_file}'] = f'data/student_images/{student_id}/{img_file}'
+        return images
+    
+    def retrain_changed_images(self):
+        """Incrementally retrain using the per-image manifest
+        
+        Images are compared with image_manifest by size and modification time,
+        confirmed with a content hash. For each student with an added, changed or
+        deleted image, the training images are picked again with
+        select_training_images: encodings of images that changed or are no longer
+        picked are dropped, and only picked images without an encoding are
+        encoded. A student with encodings from a model saved before per-image
+        tracking is retrained from all their picked images, since those
+        encodings cannot be traced back to an image.
+        
+        Returns:
+            int: Total number of face encodings in the model
+        """
+        with self._model_lock:
+            return self._retrain_changed_images()
+    
+    def _retrain_changed_images(self):
+        """Incrementally retrain the current model, with _model_lock held"""
+        import concurrent.futures
+        
+        start_time = time.time()
+        current = self.scan_student_images()
+        
+        self._ensure_image_manifest()
+        
+        added, changed = [], []
+        manifest_changed = False
+        for source, path in current.items():
+            entry = self.image_manifest.get(source)
+            if entry is None:
+                added.append(source)
+                continue
+            
+            stat = os.stat(path)
+            if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+                continue
+            
+            # Size or mtime differ - only a real content change needs retraining
+            if stat.st_size != entry['size'] or self._file_hash(path) != entry['sha1']:
+                changed.append(source)
+            else:
+                entry['mtime'] = stat.st_mtime
+                manifest_changed = True
+        
+        deleted = [source for source in self.image_manifest if source not in current]
+        
+        if not (added or changed or deleted):
+            if manifest_changed:
+                self.save_image_manifest()
+            print("No image changes to train!")
+            return len(self.known_face_encodings)
+        
+        print(f"Incremental training: {len(added)} added, {len(changed)} changed, {len(deleted)} deleted images")
+        
+        for source in deleted:
+            del self.image_manifest[source]
+        
+        # Pick the training images again for every student with a change
+        affected = set(source.split('/', 1)[0] for source in added + changed + deleted)
+        current_files = {}
+        for source in current:
+            student_id, img_file = source.split('/', 1)
+            current_files.setdefault(student_id, []).append(img_file)
+        selected = {
+            student_id: set(f'{student_id}/{f}' for f in self.select_training_images(current_files.get(student_id, [])))
+            for student_id in affected
+        }
+        
+        # Students whose encodings have no source records are retrained completely
+        legacy = set(str(name) for name, source in zip(self.known_face_names, self.known_face_sources)
+                     if source is None and str(name) in affected)
+        if legacy:
+            print(f"Retraining {len(legacy)} students trained before per-image tracking")
+        
+        # Drop encodings of changed images, images no longer picked and legacy students
+        stale = set(changed)
+        keep = [
+            i for i, (name, source) in enumerate(zip(self.known_face_names, self.known_face_sources))
+            if str(name) not in affected
+            or (str(name) not in legacy and source in selected[str(name)] and source not in stale)
+        ]
+        if len(keep) != len(self.known_face_names):
+            self.known_face_encodings = [self.known_face_encodings[i] for i in keep]
+            self.known_face_names = [self.known_face_names[i] for i in keep]
+            self.known_face_sources = [self.known_face_sources[i] for i in keep]
+        
+        # Encode picked images that have no encoding, grouped by student so each chip file is read once
+        encoded = set(self.known_face_sources)
+        by_student = {}
+        for student_id in affected:
+            for source in sorted(selected[student_id] - encoded):
+                by_student.setdefault(student_id, []).append(source.split('/', 1)[1])
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = {
+                executor.submit(self.encode_images, student_id, image_files): student_id
+                for student_id, image_files in by_student.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                student_encodings = future.result()
+                if student_encodings:
+                    self.add_student_encodings(
+                        futures[future],
+                        [encoding for _, encoding in student_encodings],
+                        [source for source, _ in student_encodings]
+                    )
+        
+        self.record_images(added + changed)
+        self.trained_students = set(str(name) for name in self.known_face_names)
+        
+        self.save_model()
+        self.save_trained_students()
+        self.save_image_manifest()
+        
+        total_time = time.time() - start_time
+        print(f"Incremental training completed in {total_time:.2f} seconds with {len(self.known_face_encodings)} total face encodings")
+        return len(self.known_face_encodings)
+    
     # Modified to use GPU acceleration when available
-    def recognize_faces(self, image):
-        """Recognize faces in the given image with GPU acceleration if available"""
+    def recognize_faces(self, image, budget_ms=None, roster=None):
+        """Recognize faces in the given image with GPU acceleration if available
+        
+        Args:
+            image: OpenCV image (numpy array) in BGR format
+            budget_ms: Optional latency budget for this call. When no face is found on
+                the first pass, the more expensive retry only runs if fallback_policy
+                expects it to fit in what is left of the budget and to pay off.
+            roster: Optional student IDs (e.g. a class section) to match against first.
+                Faces that match nobody on the roster fall back to the full gallery.
+        
+        Returns:
+            list: IDs of the recognized students
+        """
+        start_time = time.monotonic()
+        deadline = start_time + budget_ms / 1000.0 if budget_ms is not None else None
+        
         # If model is not trained, return empty list
-        if not self.known_face_encodings:
+        if not self.gallery_size():
             return []
         
         # Preprocess the image
@@ -314,19 +897,28 @@ class FaceRecognizer:
             rgb_image = processed_image
             
         # Find faces with GPU-optimized model if available
+        pixels = rgb_image.shape[0] * rgb_image.shape[1]
+        detect_start = time.monotonic()
         face_locations = face_recognition.face_locations(
             rgb_image, 
             model='cnn' if self.use_gpu else 'hog',
             number_of_times_to_upsample=1
         )
+        if not self.use_gpu:
+            # Only HOG timings say anything about the cost of the HOG retry
+            self.fallback_policy.record_first_pass(pixels, time.monotonic() - detect_start)
         
-        # If no faces found, try again with different parameters
+        # If no faces found, try again with different parameters when it is worth it
         if not face_locations:
-            face_locations = face_recognition.face_locations(
-                rgb_image, 
-                model='hog',  # Fall back to HOG
-                number_of_times_to_upsample=2
-            )
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if self.fallback_policy.should_retry(pixels, remaining):
+                retry_start = time.monotonic()
+                face_locations = face_recognition.face_locations(
+                    rgb_image, 
+                    model='hog',  # Fall back to HOG
+                    number_of_times_to_upsample=2
+                )
+                self.fallback_policy.record_retry(bool(face_locations), pixels, time.monotonic() - retry_start)
         
         if not face_locations:
             return []
@@ -341,56 +933,258 @@ class FaceRecognizer:
         
         recognized_students = []
         
-        # Compare with known faces with stricter threshold
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings, 
-                face_encoding,
-                tolerance=0.5  # Lower tolerance for stricter matching
-            )
-            
-            # Use the known face with the smallest distance to the new face
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-            
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
+        # Compare with known faces with stricter threshold, using the known face
+        # with the smallest distance to each new face
+        for student_id, best_distance in self.match_faces(face_encodings, roster):
+            if best_distance is not None:
                 # Use a stricter threshold for more accurate matching
-                if matches[best_match_index] and face_distances[best_match_index] < 0.5:
-                    student_id = self.known_face_names[best_match_index]
-                    
+                if best_distance < self.match_threshold:
                     # Only add unique student IDs
                     if student_id not in recognized_students:
                         recognized_students.append(student_id)
         
         return recognized_students
     
+    def recognize_all_faces(self, image, budget_ms=None, roster=None):
+        """Recognize every face in an image such as a classroom photo
+        
+        Each detected face is cropped and recognized on its own. If no face is
+        detected, the whole image is passed to recognize_faces instead.
+        
+        Args:
+            image: OpenCV image (numpy array) in BGR format
+            budget_ms: Optional latency budget shared by all faces in the image
+            roster: Optional student IDs to match against first
+        
+        Returns:
+            list: IDs of the recognized students
+        """
+        start_time = time.monotonic()
+        
+        face_images = self.extract_all_faces(image)
+        if not face_images:
+            face_images = [image]
+        
+        recognized_students = []
+        for face_img in face_images:
+            remaining_ms = None
+            if budget_ms is not None:
+                remaining_ms = max(0.0, budget_ms - (time.monotonic() - start_time) * 1000)
+            for student_id in self.recognize_faces(face_img, budget_ms=remaining_ms, roster=roster):
+                if student_id not in recognized_students:
+                    recognized_students.append(student_id)
+        
+        return recognized_students
+    
     def base64_to_image(self, base64_string):
-        """Convert base64 string to an OpenCV image"""
-        # Remove the data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-            
-        # Decode base64 string
-        img_data = base64.b64decode(base64_string)
+        """Convert base64 string to an OpenCV image, or None if it cannot be decoded
+        
+        Kept for existing callers; routes use modules.image_decode directly.
+        """
+        try:
+            return decode_base64_image(base64_string)
+        except ImageDecodeError as e:
+            print(f"Error decoding image: {e}")
+            return None
+        
+    def gallery_matrix(self):
+        """Return the known face encodings as a cached (N, 128) numpy array"""
+        key = (self._gallery_version, len(self.known_face_encodings))
+        if self._gallery_cache_key != key:
+            self._gallery_cache = np.asarray(self.known_face_encodings, dtype=np.float64).reshape(-1, 128)
+            self._gallery_cache_key = key
+        return self._gallery_cache
+    
+    def roster_gallery(self, roster):
+        """Return the sub-gallery for a roster of student IDs, cached per roster
+        
+        Returns:
+            tuple: (matrix, indices) where matrix holds the roster's encodings and
+                indices maps each row back to its position in the full gallery
+        """
+        roster_ids = frozenset(str(student_id) for student_id in roster)
+        key = (self._gallery_version, len(self.known_face_encodings), roster_ids)
+        
+        with self._roster_lock:
+            cached = self._roster_cache.get(key)
+            if cached is not None:
+                self._roster_cache.move_to_end(key)
+                return cached
+        
+        gallery = self.gallery_matrix()
+        names = np.asarray(self.known_face_names, dtype=str)
+        indices = np.flatnonzero(np.isin(names, list(roster_ids))) if len(names) else np.array([], dtype=int)
+        cached = (gallery[indices], indices)
+        
+        with self._roster_lock:
+            self._roster_cache[key] = cached
+            while len(self._roster_cache) > self._roster_cache_size:
+                self._roster_cache.popitem(last=False)
+        return cached
+    
+    def best_match(self, face_encoding, roster=None):
+        """Find the closest known face with a single vectorised distance pass
+        
+        Args:
+            face_encoding: Encoding of the face to match
+            roster: Optional student IDs to restrict the search to
+        
+        Returns:
+            tuple: (index, distance) of the closest known encoding, or (None, None) if the gallery is empty
+        """
+        if roster is None:
+            gallery, indices = self.gallery_matrix(), None
+        else:
+            gallery, indices = self.roster_gallery(roster)
+        if len(gallery) == 0:
+            return None, None
+        
+        face_distances = np.linalg.norm(gallery - face_encoding, axis=1)
+        best_match_index = int(np.argmin(face_distances))
+        best_distance = float(face_distances[best_match_index])
+        if indices is not None:
+            best_match_index = int(indices[best_match_index])
+        return best_match_index, best_distance
+    
+    def score_batch(self, probes, roster=None):
+        """Match several face encodings against the gallery as one matrix operation
+        
+        Args:
+            probes: Sequence of face encodings
+            roster: Optional student IDs to restrict the search to
+        
+        Returns:
+            list: (index, distance) of the closest known encoding for each probe,
+                or (None, None) for every probe if the gallery is empty
+        """
+        if roster is None:
+            gallery, indices = self.gallery_matrix(), None
+        else:
+            gallery, indices = self.roster_gallery(roster)
+        if len(gallery) == 0 or len(probes) == 0:
+            return [(None, None)] * len(probes)
+        
+        probes = np.asarray(probes, dtype=np.float64).reshape(-1, 128)
+        
+        # |p - g|^2 = |p|^2 + |g|^2 - 2 p.g for every probe/gallery pair at once
+        squared = (
+            np.einsum('ij,ij->i', probes, probes)[:, None]
+            + np.einsum('ij,ij->i', gallery, gallery)[None, :]
+            - 2.0 * probes @ gallery.T
+        )
+        best = np.argmin(squared, axis=1)
+        distances = np.sqrt(np.maximum(squared[np.arange(len(probes)), best], 0.0))
+        if indices is not None:
+            best = indices[best]
+        return [(int(index), float(distance)) for index, distance in zip(best, distances)]
+    
+    def enable_match_batching(self, window_ms=5.0, max_batch=256):
+        """Score faces from concurrent callers together in short time windows"""
+        from modules.batching import MatchBatcher
+        self.match_batcher = MatchBatcher(self.score_batch, window_ms=window_ms, max_batch=max_batch)
+    
+    def use_shards(self, coordinator, sync=True):
+        """Search the gallery on shard servers instead of in this process
         
-        # Convert to numpy array
-        nparr = np.frombuffer(img_data, np.uint8)
+        The model file stays the source of truth: the students whose encodings
+        differ from what the shards hold are sent now and again every time the
+        model is saved. No gallery matrix is built in this process, and every
+        search, including duplicate checks, goes to the shards. A search that a
+        shard cannot answer raises ShardError rather than returning partial
+        results.
         
-        # Decode image
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        Args:
+            coordinator: ShardCoordinator for the shard servers
+            sync: False for processes that never train, which leave updating
+                the shards to the process that saves the model
+        """
+        self.shard_coordinator = coordinator
+        if not sync:
+            return
+        try:
+            coordinator.sync(self.known_face_names, self.known_face_encodings)
+        except ShardError as e:
+            print(f"Warning: Could not update gallery shards: {e}")
+    
+    def _match(self, face_encodings, roster=None):
+        """Return (student_id, distance) for the closest known face of each encoding"""
+        if self.shard_coordinator is not None:
+            return [matches[0] if matches else (None, None)
+                    for matches in self.shard_coordinator.search(face_encodings, k=1, roster=roster)]
+        
+        matcher = self.match_batcher.match if self.match_batcher is not None else self.score_batch
+        return [(self.known_face_names[index], distance) if distance is not None else (None, None)
+                for index, distance in matcher(face_encodings, roster)]
+    
+    def match_faces(self, face_encodings, roster=None):
+        """Find the closest known face for each encoding
+        
+        With a roster, faces are matched against the roster first and only the
+        ones that match nobody on it are searched in the full gallery. Matching
+        goes through the shards or match_batcher when either is enabled.
+        
+        Returns:
+            list: (student_id, distance) for each encoding, (None, None) where the gallery is empty
+        """
+        if not roster:
+            return self._match(face_encodings)
+        
+        results = self._match(face_encodings, roster)
+        misses = [i for i, (_, distance) in enumerate(results)
+                  if distance is None or distance >= self.match_threshold]
+        self.roster_stats['roster_matches'] += len(results) - len(misses)
+        self.roster_stats['global_fallbacks'] += len(misses)
+        
+        if misses:
+            fallback = self._match([face_encodings[i] for i in misses])
+            for i, match in zip(misses, fallback):
+                results[i] = match
+        return results
+    
+    def _duplicate_check_pass(self, rgb_image, upsample, num_jitters, model):
+        """Run one detect/encode/match pass for check_face_exists
+        
+        Returns:
+            tuple: (student_id, distance) of the best match, or (None, None) if no face was encoded
+        """
+        face_locations = face_recognition.face_locations(
+            rgb_image, 
+            model='hog',
+            number_of_times_to_upsample=upsample
+        )
+        
+        if not face_locations:
+            return None, None  # No faces detected
+        
+        face_encodings = face_recognition.face_encodings(
+            rgb_image, 
+            face_locations,
+            num_jitters=num_jitters,
+            model=model
+        )
         
-        return img
+        if not face_encodings:
+            return None, None  # Could not extract features from face
         
+        # Match the first face in the image
+        return self._match(face_encodings[:1])[0]
+    
     def check_face_exists(self, image):
         """Check if the face in the image exists in the database
         
+        A cheap pass (upsample 1, 1 jitter) runs first. The expensive pass
+        (upsample 2, 3 jitters) only runs when the cheap pass finds no face or its
+        best distance falls within escalation_band of the threshold. Both passes use
+        the small landmark model the gallery was encoded with, so their distances
+        are comparable with it.
+        
         Returns:
             tuple: (exists, student_id) where:
                 - exists is a boolean indicating if the face exists
                 - student_id is the ID of the matching student if exists is True, None otherwise
         """
         # If model is not trained, no faces exist yet
-        if not self.known_face_encodings:
+        if not self.gallery_size():
             return False, None
             
         # Preprocess the image
@@ -404,61 +1198,211 @@ class FaceRecognizer:
         else:
             rgb_image = processed_image
         
-        # Find faces in the image with enhanced parameters
-        face_locations = face_recognition.face_locations(
-            rgb_image, 
-            model='hog',
-            number_of_times_to_upsample=2
-        )
-        
-        if not face_locations:
-            return False, None  # No faces detected
-            
-        # Get encodings with higher accuracy settings
-        face_encodings = face_recognition.face_encodings(
-            rgb_image, 
-            face_locations,
-            num_jitters=3
-        )
-            
-        if not face_encodings:
-            return False, None  # Could not extract features from face
-            
-        # Get the first face in the image
-        face_encoding = face_encodings[0]
+        self.duplicate_check_stats['checks'] += 1
         
-        # Compare with known faces with stricter threshold
-        matches = face_recognition.compare_faces(
-            self.known_face_encodings, 
-            face_encoding,
-            tolerance=0.5
+        # Cheap first pass - most frames are clearly new or clearly existing
+        best_student_id, best_distance = self._duplicate_check_pass(
+            rgb_image, upsample=1, num_jitters=1, model="small"
         )
         
-        # Use the known face with the smallest distance to the new face
-        face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
+        # Escalate to the expensive settings on a miss or an ambiguous margin
+        if best_distance is None or abs(best_distance - self.match_threshold) <= self.escalation_band:
+            self.duplicate_check_stats['escalations'] += 1
+            best_student_id, best_distance = self._duplicate_check_pass(
+                rgb_image, upsample=2, num_jitters=3, model="small"
+            )
         
-        if len(face_distances) > 0:
-            best_match_index = np.argmin(face_distances)
-            if matches[best_match_index] and face_distances[best_match_index] < 0.5:  # Stricter threshold
-                try:
-                    # Convert to int to ensure it's a valid ID
-                    student_id = int(self.known_face_names[best_match_index])
-                    return True, student_id
-                except (ValueError, TypeError):
-                    # If ID is not valid, return no match
-                    print(f"Warning: Invalid student ID in face recognition model: {self.known_face_names[best_match_index]}")
-                    return False, None
+        if best_distance is not None and best_distance < self.match_threshold:
+            try:
+                # Convert to int to ensure it's a valid ID
+                student_id = int(best_student_id)
+                return True, student_id
+            except (ValueError, TypeError):
+                # If ID is not valid, return no match
+                print(f"Warning: Invalid student ID in face recognition model: {best_student_id}")
+                return False, None
                 
         return False, None
     
+    def verify_face_chip(self, image, box=None, min_size=48, max_size=640):
+        """Cheaply check that a face chip cropped by the browser holds one usable face
+        
+        Instead of running the detector, the 5-point landmark model is fitted to
+        the box the browser reported and the landmark geometry is checked: both
+        eyes inside the box at a plausible distance apart, with the nose below them.
+        
+        Args:
+            image: Chip (numpy array) in BGR format
+            box: (x, y, width, height) of the face within the chip. Defaults to the
+                whole chip.
+            min_size: Smallest accepted chip side in pixels
+            max_size: Largest accepted chip side in pixels. Larger uploads are full
+                frames rather than chips and go through normal detection.
+        
+        Returns:
+            tuple: (aligned_chip, landmarks) ready for encode_face_chip, or (None, None)
+                if the chip failed verification
+        """
+        if image is None or image.ndim != 3:
+            return None, None
+        
+        height, width = image.shape[:2]
+        if min(height, width) < min_size or max(height, width) > max_size:
+            return None, None
+        if not 0.5 <= width / height <= 2.0:
+            return None, None
+        
+        x, y, box_width, box_height = box if box is not None else (0, 0, width, height)
+        left, top = max(0, int(x)), max(0, int(y))
+        right, bottom = min(width, int(x + box_width)), min(height, int(y + box_height))
+        if right - left < min_size // 2 or bottom - top < min_size // 2:
+            return None, None
+        
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        shape = face_recognition.api.pose_predictor_5_point(rgb_image, dlib.rectangle(left, top, right, bottom))
+        landmarks = np.array([(point.x, point.y) for point in shape.parts()], dtype=np.int32)
+        
+        # Points 0-1 and 2-3 are the corners of each eye, point 4 the base of the nose
+        eye_a = landmarks[0:2].mean(axis=0)
+        eye_b = landmarks[2:4].mean(axis=0)
+        nose = landmarks[4]
+        eye_distance = np.linalg.norm(eye_a - eye_b) / (right - left)
+        
+        # The browser's detector draws looser or tighter boxes than dlib's, so allow some margin
+        margin_x, margin_y = 0.2 * (right - left), 0.2 * (bottom - top)
+        inside = np.all((landmarks[:, 0] >= left - margin_x) & (landmarks[:, 0] < right + margin_x) &
+                        (landmarks[:, 1] >= top - margin_y) & (landmarks[:, 1] < bottom + margin_y))
+        if not inside or not 0.2 <= eye_distance <= 0.75 or nose[1] <= min(eye_a[1], eye_b[1]):
+            return None, None
+        
+        chip = dlib.get_face_chip(rgb_image, shape, size=self.chip_store.chip_size, padding=self.chip_store.padding)
+        return chip, landmarks
+    
+    def _encode_verified_chips(self, chips):
+        """Verify and encode (image, box) chips
+        
+        Returns:
+            tuple: (encodings, rejected) where rejected lists the indexes of chips
+                that failed verification
+        """
+        encodings, rejected = [], []
+        for i, (image, box) in enumerate(chips):
+            aligned, _ = self.verify_face_chip(image, box)
+            if aligned is None:
+                rejected.append(i)
+                continue
+            encodings.append(self.encode_face_chip(aligned, num_jitters=5 if self.use_gpu else 1))
+        
+        self.chip_stats['chips_accepted'] += len(chips) - len(rejected)
+        self.chip_stats['chips_rejected'] += len(rejected)
+        return encodings, rejected
+    
+    def recognize_face_chips(self, chips, roster=None):
+        """Recognize faces already cropped by the browser detector
+        
+        Chips that pass verify_face_chip are encoded directly, skipping
+        detection. Chips that fail it go through recognize_faces like any
+        other image, which is still cheap on a small crop.
+        
+        Args:
+            chips: List of (image, box) pairs, image in BGR format and box the
+                (x, y, width, height) of the face within it or None
+            roster: Optional student IDs to match against first
+        
+        Returns:
+            list: IDs of the recognized students
+        """
+        if not self.gallery_size():
+            return []
+        
+        encodings, rejected = self._encode_verified_chips(chips)
+        
+        recognized_students = []
+        for student_id, distance in self.match_faces(encodings, roster):
+            if distance is not None and distance < self.match_threshold and student_id not in recognized_students:
+                recognized_students.append(student_id)
+        
+        for i in rejected:
+            for student_id in self.recognize_faces(chips[i][0], roster=roster):
+                if student_id not in recognized_students:
+                    recognized_students.append(student_id)
+        
+        return recognized_students
+    
+    def check_face_chip_exists(self, image, box=None):
+        """Like check_face_exists, for a face chip cropped by the browser detector
+        
+        A chip that passes verify_face_chip is encoded with 1 jitter and only
+        re-encoded with 3 jitters when the distance lands within escalation_band
+        of the threshold. A chip that fails verification is handed to
+        check_face_exists.
+        
+        Returns:
+            tuple: (exists, student_id) as for check_face_exists
+        """
+        if not self.gallery_size():
+            return False, None
+        
+        aligned, _ = self.verify_face_chip(image, box)
+        if aligned is None:
+            self.chip_stats['chips_rejected'] += 1
+            return self.check_face_exists(image)
+        self.chip_stats['chips_accepted'] += 1
+        
+        self.duplicate_check_stats['checks'] += 1
+        best_student_id, best_distance = self._match([self.encode_face_chip(aligned, num_jitters=1)])[0]
+        if best_distance is None or abs(best_distance - self.match_threshold) <= self.escalation_band:
+            self.duplicate_check_stats['escalations'] += 1
+            best_student_id, best_distance = self._match([self.encode_face_chip(aligned, num_jitters=3)])[0]
+        
+        if best_distance is not None and best_distance < self.match_threshold:
+            try:
+                return True, int(best_student_id)
+            except (ValueError, TypeError):
+                print(f"Warning: Invalid student ID in face recognition model: {best_student_id}")
+                return False, None
+        
+        return False, None
+    
+    def gallery_size(self):
+        """Return the number of known face encodings
+        
+        In shard mode this asks the shards, since a process that does not load
+        the gallery holds no encodings of its own.
+        """
+        if self.shard_coordinator is not None:
+            return sum(stats['encodings'] for stats in self.shard_coordinator.stats())
+        return len(self.known_face_encodings)
+    
+    def get_metrics(self):
+        """Return runtime counters for the recognizer"""
+        checks = self.duplicate_check_stats['checks']
+        escalations = self.duplicate_check_stats['escalations']
+        try:
+            gallery_size = self.gallery_size()
+        except ShardError:
+            gallery_size = None  # A shard is unreachable
+        metrics = {
+            'gallery_size': gallery_size,
+            'duplicate_checks': checks,
+            'duplicate_check_escalations': escalations,
+            'duplicate_check_escalation_rate': escalations / checks if checks else 0.0
+        }
+        metrics.update(self.fallback_policy.get_stats())
+        metrics.update(self.roster_stats)
+        metrics.update(self.chip_stats)
+        if self.match_batcher is not None:
+            metrics.update(self.match_batcher.get_stats())
+        return metrics
+    
     def preprocess_image(self, image):
         """Preprocess image for better face detection"""
         # Check if image is valid
         if image is None or image.size == 0:
             return None
             
-        # Make a copy to avoid modifying the original
-        processed_image = image.copy()
+        # Resizing and colour conversion below return new arrays, so the original is never modified
+        processed_image = image
         
         # Resize if too large (helps with performance)
         max_size = 1024
@@ -578,4 +1522,35 @@ class FaceRecognizer:
             face_image = image[top:bottom, left:right]
             faces.append(face_image)
         
-        return faces
\ No newline at end of file
+        return faces
+
+
+def create_face_recognizer(match_batching=True, trains=True):
+    """Create a FaceRecognizer configured from the environment
+    
+    Shared by the web app and the inference pool workers, so both match the
+    same way: MATCH_BATCH_WINDOW_MS enables match batching and GALLERY_SHARDS
+    (with SHARD_AUTHKEY) searches the gallery on shard servers.
+    
+    Args:
+        match_batching: False for callers that run one task at a time, where a
+            batching window would only add latency
+        trains: False for processes that only recognize; with shards configured
+            they then neither load the gallery nor update the shards
+    """
+    gallery_shards = [address for address in os.environ.get('GALLERY_SHARDS', '').split(',') if address]
+    recognizer = FaceRecognizer(load_gallery=trains or not gallery_shards)
+    
+    # Window for batching face matching across concurrent requests (0 disables batching)
+    match_batch_window_ms = float(os.environ.get('MATCH_BATCH_WINDOW_MS', 0))
+    if match_batch_window_ms > 0:
+        if match_batching:
+            recognizer.enable_match_batching(window_ms=match_batch_window_ms)
+        else:
+            print("Warning: MATCH_BATCH_WINDOW_MS is ignored here, each process matches one request at a time")
+    
+    # Search the gallery on shard servers (modules/sharding.py) when configured
+    if gallery_shards:
+        authkey = os.environ['SHARD_AUTHKEY'].encode('utf-8')
+        recognizer.use_shards(ShardCoordinator(gallery_shards, authkey), sync=trains)
+    return recognizer
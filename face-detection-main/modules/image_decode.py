@@ -0,0 +1,282 @@
+import os
+import struct
+import base64
+import binascii
+import threading
+from io import BytesIO
+import numpy as np
+from modules.startup import LazyModule
+
+cv2 = LazyModule('cv2')
+
+# Recognition never looks at more than this many pixels along the longest side
+TARGET_SIDE = 1024
+
+# Anything beyond these limits is rejected before it is decoded
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_MB', 20)) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_MEGAPIXELS', 50)) * 1000 * 1000
+
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+decode_stats = {'images_decoded': 0, 'images_decoded_reduced': 0, 'images_rejected': 0}
+_stats_lock = threading.Lock()
+
+
+class ImageDecodeError(ValueError):
+    """Raised when uploaded data is not a decodable image"""
+
+
+class ImageTooLarge(ImageDecodeError):
+    """Raised when an image exceeds the byte or pixel limit"""
+
+
+def _count(stat):
+    with _stats_lock:
+        decode_stats[stat] += 1
+
+
+def _exif_orientation(segment):
+    """Read the orientation tag from the body of a JPEG APP1 segment, or return 1"""
+    if bytes(segment[:6]) != b'Exif\x00\x00':
+        return 1
+    tiff = segment[6:]
+    try:
+        endian = {b'II': '<', b'MM': '>'}[bytes(tiff[:2])]
+        ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+        entries = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+        for i in range(entries):
+            entry = ifd + 2 + i * 12
+            if struct.unpack(endian + 'H', tiff[entry:entry + 2])[0] == 0x0112:
+                return struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def _webp_size(buffer):
+    """Read the canvas size from the first chunk of a WebP file, or return (None, None)"""
+    chunk = bytes(buffer[12:16])
+    if chunk == b'VP8 ' and len(buffer) >= 30:
+        width, height = struct.unpack('<HH', buffer[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(buffer) >= 25:
+        bits = struct.unpack('<I', buffer[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(buffer) >= 30:
+        return (int.from_bytes(buffer[24:27], 'little') + 1, int.from_bytes(buffer[27:30], 'little') + 1)
+    return None, None
+
+
+def read_header(buffer):
+    """Read an image's size and EXIF orientation from its header without decoding it
+
+    Only the JPEG segments before the image data, the PNG IHDR chunk and the
+    fixed BMP and WebP headers are looked at, so this costs next to nothing
+    however large the image is.
+
+    Returns:
+        tuple: (format, width, height, orientation), with format, width and
+            height None when the format is not recognised
+    """
+    if bytes(buffer[:8]) == _PNG_SIGNATURE and len(buffer) >= 24:
+        width, height = struct.unpack('>II', buffer[16:24])
+        return 'png', width, height, 1
+
+    if bytes(buffer[:2]) == b'BM' and len(buffer) >= 26:
+        width, height = struct.unpack('<ii', buffer[18:26])
+        # Top-down bitmaps store a negative height
+        return 'bmp', abs(width), abs(height), 1
+
+    if bytes(buffer[:4]) == b'RIFF' and bytes(buffer[8:12]) == b'WEBP':
+        width, height = _webp_size(buffer)
+        return 'webp', width, height, 1
+
+    if bytes(buffer[:2]) != b'\xff\xd8':
+        return None, None, None, 1
+
+    orientation = 1
+    i = 2
+    while i + 4 <= len(buffer):
+        if buffer[i] != 0xFF:
+            break
+        marker = buffer[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of the compressed data without a frame header
+            break
+
+        length = struct.unpack('>H', buffer[i + 2:i + 4])[0]
+        if marker == 0xE1:
+            orientation = _exif_orientation(buffer[i + 4:i + 2 + length])
+        elif marker in _SOF_MARKERS and i + 9 <= len(buffer):
+            height, width = struct.unpack('>HH', buffer[i + 5:i + 9])
+            return 'jpeg', width, height, orientation
+        i += 2 + length
+
+    return 'jpeg', None, None, orientation
+
+
+def _apply_orientation(image, orientation):
+    """Rotate or flip a decoded image according to its EXIF orientation"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def _reduced_flag(width, height, max_side):
+    """Pick the largest JPEG reduction that keeps the longest side at least max_side"""
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) // factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(buffer, max_side=TARGET_SIDE, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """Decode an encoded image held in memory into a BGR OpenCV image
+
+    The header is read first, so images over the limits are rejected before any
+    pixels are decoded. Only JPEG, PNG, BMP and WebP images whose size can be
+    read from the header are accepted, since the pixel limit could not be
+    enforced for anything else. Large JPEGs are decoded at 1/2, 1/4 or 1/8 scale
+    directly by libjpeg when the result is still at least max_side pixels along
+    its longest side, which is far faster and uses far less memory than
+    decoding at full size and resizing afterwards. EXIF orientation is applied
+    to the decoded image either way.
+
+    Args:
+        buffer: bytes, bytearray or memoryview holding the encoded image. It is
+            wrapped without being copied.
+        max_side: Smallest longest side the caller needs, or None for full resolution
+        max_bytes: Largest accepted encoded size
+        max_pixels: Largest accepted width x height
+
+    Returns:
+        numpy.ndarray: The decoded image in BGR format
+
+    Raises:
+        ImageTooLarge: If the image exceeds max_bytes or max_pixels
+        ImageDecodeError: If the data is empty, in an unsupported format or not a
+            decodable image
+    """
+    if len(buffer) == 0:
+        raise ImageDecodeError('Empty image')
+    if len(buffer) > max_bytes:
+        _count('images_rejected')
+        raise ImageTooLarge(f'Image is {len(buffer)} bytes, the limit is {max_bytes}')
+
+    image_format, width, height, orientation = read_header(buffer)
+    if image_format is None:
+        raise ImageDecodeError('Unsupported image format')
+    if width is None:
+        raise ImageDecodeError(f'Could not read the size of the {image_format} image')
+    if width * height > max_pixels:
+        _count('images_rejected')
+        raise ImageTooLarge(f'Image is {width}x{height} pixels, the limit is {max_pixels}')
+
+    flag = cv2.IMREAD_COLOR
+    if image_format == 'jpeg' and max_side:
+        flag = _reduced_flag(width, height, max_side)
+
+    image = cv2.imdecode(np.frombuffer(buffer, np.uint8), flag | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ImageDecodeError('Could not decode image')
+
+    _count('images_decoded')
+    if flag != cv2.IMREAD_COLOR:
+        _count('images_decoded_reduced')
+    return _apply_orientation(image, orientation)
+
+
+def decode_base64_image(data, max_side=TARGET_SIDE, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """Decode a base64 image, optionally a data URL, as sent by the browser
+
+    The size is checked from the length of the base64 text, before it is decoded.
+    """
+    comma = data.find(',', 0, 256)
+    if comma != -1:
+        data = data[comma + 1:]
+
+    if len(data) * 3 // 4 > max_bytes:
+        _count('images_rejected')
+        raise ImageTooLarge(f'Image is about {len(data) * 3 // 4} bytes, the limit is {max_bytes}')
+
+    try:
+        buffer = base64.b64decode(data)
+    except (binascii.Error, ValueError) as e:
+        raise ImageDecodeError(f'Invalid base64 image: {e}')
+    return decode_image(buffer, max_side, max_bytes, max_pixels)
+
+
+def read_upload(file, max_bytes=MAX_IMAGE_BYTES):
+    """Return the contents of an uploaded file
+
+    Uploads held in a BytesIO (the app's UploadRequest keeps those of small
+    requests in memory) are returned as a view of that buffer, without a copy.
+    Others are read from werkzeug's spool file, stopping as soon as the limit
+    is passed. Release a returned memoryview once done with it, or werkzeug
+    cannot close the upload.
+
+    Raises:
+        ImageTooLarge: If the upload is larger than max_bytes
+    """
+    stream = file.stream
+    if isinstance(stream, BytesIO):
+        buffer = stream.getbuffer()
+    else:
+        stream.seek(0)
+        buffer = stream.read(max_bytes + 1)
+
+    if len(buffer) > max_bytes:
+        if isinstance(buffer, memoryview):
+            buffer.release()
+        _count('images_rejected')
+        raise ImageTooLarge(f'Upload is larger than {max_bytes} bytes')
+    return buffer
+
+
+def decode_upload(file, max_side=TARGET_SIDE, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """Decode an uploaded image file (a werkzeug FileStorage)"""
+    buffer = read_upload(file, max_bytes)
+    try:
+        return decode_image(buffer, max_side, max_bytes, max_pixels)
+    finally:
+        # Let werkzeug close the in-memory upload once the request is done
+        if isinstance(buffer, memoryview):
+            buffer.release()
+
+
+def decode_image_file(path, max_side=TARGET_SIDE, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """Decode an image file, like cv2.imread but size-aware
+
+    Raises:
+        ImageDecodeError: If the file is missing, too large or not an image
+    """
+    try:
+        if os.path.getsize(path) > max_bytes:
+            _count('images_rejected')
+            raise ImageTooLarge(f'{path} is larger than {max_bytes} bytes')
+        with open(path, 'rb') as f:
+            buffer = f.read()
+    except OSError as e:
+        raise ImageDecodeError(f'Could not read {path}: {e}')
+    return decode_image(buffer, max_side, max_bytes, max_pixels)
@@ -0,0 +1,346 @@
+"""Pool of long-lived, pre-warmed recognition worker processes
+
+Detection and encoding are CPU-bound and hold the GIL, so running them inline
+in Flask request threads stalls every other request in the same web worker.
+The pool runs them in separate processes that each hold a warmed-up
+FaceRecognizer, and web workers reach it over a local Unix socket:
+
+    INFERENCE_AUTHKEY=secret python -m modules.inference_pool --socket /tmp/face-inference.sock --workers 4
+
+and then start the web app with INFERENCE_SOCKET=/tmp/face-inference.sock and
+the same INFERENCE_AUTHKEY. The socket is created readable by its owner only,
+and connections that do not know the key are refused before anything is
+unpickled.
+
+All web workers share the one pool, so CPU cores are used fully however many
+web workers are running. When more than max_queue_depth requests are in flight
+the pool answers "busy" immediately instead of queueing without bound. Requests
+whose caller has given up still count until a worker takes them off the queue,
+and workers skip them instead of running them.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+# Seconds the pool waits for a task before answering with an error
+TASK_TIMEOUT = 120.0
+
+# FaceRecognizer methods that may be called through the pool
+ALLOWED_METHODS = {
+    'recognize_faces',
+    'recognize_all_faces',
+    'check_face_exists',
+    'detect_and_crop_face',
+    'extract_all_faces',
+    'verify_face_chip',
+    'recognize_face_chips',
+    'check_face_chip_exists',
+}
+
+
+# Metrics that are ratios of two counters, recomputed after counters are summed
+_RATIO_METRICS = {
+    'duplicate_check_escalation_rate': ('duplicate_check_escalations', 'duplicate_checks'),
+    'fallback_hit_rate': ('fallback_hits', 'fallback_attempts'),
+    'match_batch_mean_size': ('match_batch_probes', 'match_batches'),
+}
+
+
+def merge_metrics(snapshots):
+    """Combine FaceRecognizer.get_metrics() results from several processes
+
+    Counters are summed and the ratios recomputed from the sums. Every process
+    loads the same gallery, so gallery_size is the largest one reported.
+    """
+    merged = {}
+    for metrics in snapshots:
+        for key, value in metrics.items():
+            if key == 'gallery_size':
+                merged[key] = max(merged.get(key, 0), value)
+            elif key not in _RATIO_METRICS:
+                merged[key] = merged.get(key, 0) + value
+    for key, (numerator, denominator) in _RATIO_METRICS.items():
+        if denominator in merged:
+            merged[key] = merged[numerator] / merged[denominator] if merged[denominator] else 0.0
+    return merged
+
+
+class InferencePoolBusy(Exception):
+    """Raised when the pool has too many requests in flight to accept another"""
+
+
+class InferencePoolError(Exception):
+    """Raised when the pool cannot be reached or a task fails in a worker"""
+
+
+def _worker_main(task_queue, result_queue):
+    """Entry point of a worker process: warm up once, then serve tasks forever"""
+    from modules.face_recognition import create_face_recognizer
+
+    # Configured like the web app's recognizer so shards apply here too. A worker
+    # runs one task at a time, so there is nothing for match batching to combine.
+    recognizer = create_face_recognizer(match_batching=False, trains=False)
+    recognizer.warm_up()
+
+    while True:
+        task_id, deadline, method, args, kwargs = task_queue.get()
+        if time.time() > deadline:
+            # Nobody is waiting for the answer any more
+            result_queue.put((task_id, False, 'Task expired before a worker was free', None))
+            continue
+        try:
+            # Pick up models saved by the web app since the last task
+            recognizer.reload_if_changed()
+            ok, result = True, getattr(recognizer, method)(*args, **kwargs)
+        except Exception as e:
+            ok, result = False, f"{type(e).__name__}: {e}"
+        # Each answer carries this worker's counters, which the pool reports as metrics
+        result_queue.put((task_id, ok, result, (os.getpid(), recognizer.get_metrics())))
+
+
+class InferencePoolServer:
+    """Accepts recognition requests on a Unix socket and runs them on worker processes"""
+
+    def __init__(self, address, authkey, workers=None, max_queue_depth=64, task_timeout=TASK_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.task_timeout = task_timeout
+        self.num_workers = workers or os.cpu_count() or 1
+        self.max_queue_depth = max_queue_depth
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.workers = []
+        self._pending = {}  # task_id -> [threading.Event, result, deadline]
+        self._pending_lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._worker_metrics = {}  # pid -> latest get_metrics() of that worker
+
+    def start_workers(self):
+        """Start the worker processes and the result dispatcher"""
+        for _ in range(self.num_workers):
+            self.workers.append(self._spawn_worker())
+        threading.Thread(target=self._dispatch_results, daemon=True).start()
+        threading.Thread(target=self._monitor_workers, daemon=True).start()
+
+    def _spawn_worker(self):
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(self.task_queue, self.result_queue),
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def _monitor_workers(self):
+        """Replace worker processes that have died"""
+        while True:
+            time.sleep(1.0)
+            for i, process in enumerate(self.workers):
+                if not process.is_alive():
+                    print(f"Inference worker {process.pid} exited with code {process.exitcode}, restarting")
+                    self.workers[i] = self._spawn_worker()
+            self._forget_lost_tasks()
+
+    def _forget_lost_tasks(self):
+        """Stop counting abandoned tasks that will never be answered
+
+        Workers answer expired tasks straight away, so a task still pending long
+        after its deadline was running on a worker that died.
+        """
+        cutoff = time.time() - self.task_timeout
+        with self._pending_lock:
+            for task_id in [task_id for task_id, slot in self._pending.items() if slot[2] < cutoff]:
+                del self._pending[task_id]
+
+    def _dispatch_results(self):
+        """Hand results coming back from the workers to the waiting connections"""
+        while True:
+            task_id, ok, result, worker_metrics = self.result_queue.get()
+            with self._pending_lock:
+                slot = self._pending.pop(task_id, None)
+                if worker_metrics is not None:
+                    pid, metrics = worker_metrics
+                    self._worker_metrics[pid] = metrics
+            if slot is not None:
+                slot[1] = (ok, result)
+                slot[0].set()
+
+    def queue_depth(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def metrics(self):
+        """Recognizer metrics summed over every worker, including ones since restarted"""
+        with self._pending_lock:
+            snapshots = list(self._worker_metrics.values())
+        metrics = merge_metrics(snapshots)
+        metrics['inference_queue_depth'] = self.queue_depth()
+        return metrics
+
+    def submit(self, method, args, kwargs):
+        """Queue a task and wait for its result
+
+        A task that times out stays pending, and so keeps counting toward
+        max_queue_depth, until a worker answers or skips it.
+
+        Returns:
+            tuple: (status, payload) where status is 'ok', 'error' or 'busy'
+        """
+        if method not in ALLOWED_METHODS:
+            return 'error', f"Method not allowed: {method}"
+
+        deadline = time.time() + self.task_timeout
+        slot = [threading.Event(), None, deadline]
+        with self._pending_lock:
+            if len(self._pending) >= self.max_queue_depth:
+                return 'busy', len(self._pending)
+            task_id = next(self._task_ids)
+            self._pending[task_id] = slot
+
+        self.task_queue.put((task_id, deadline, method, args, kwargs))
+        # A worker that dies mid-task never answers, so don't wait forever
+        if not slot[0].wait(self.task_timeout):
+            return 'error', f"Task timed out after {self.task_timeout} seconds"
+
+        ok, result = slot[1]
+        return ('ok', result) if ok else ('error', result)
+
+    def _handle_connection(self, conn):
+        """Serve requests from one client connection until it closes"""
+        try:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except EOFError:
+                    break
+                if method == 'metrics':
+                    # Answered by the server itself, so it never waits behind queued tasks
+                    conn.send(('ok', self.metrics()))
+                    continue
+                conn.send(self.submit(method, args, kwargs))
+        except Exception as e:
+            print(f"Inference connection error: {e}")
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        """Start the workers and accept connections until interrupted"""
+        # Remove a socket left behind by a previous run
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        self.start_workers()
+        # Create the socket owner-only from the start rather than tightening it
+        # after bind, so nobody else can connect in between
+        umask = os.umask(0o077)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        print(f"Inference pool listening on {self.address} with {self.num_workers} workers")
+
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed authentication or a dropped handshake
+                    print(f"Rejected inference connection: {e}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+
+class InferenceClient:
+    """Calls FaceRecognizer methods on the inference pool
+
+    Exposes the pool-safe FaceRecognizer methods, so it can be used in place of
+    a local recognizer. Each thread keeps its own connection to the pool.
+
+    The default timeout is a little longer than the pool's own task timeout, so
+    a slow task is reported by the pool rather than abandoned by the client.
+    """
+
+    def __init__(self, address, authkey, timeout=TASK_TIMEOUT + 5.0):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                raise InferencePoolError(f"Cannot connect to inference pool at {self.address}: {e}")
+            self._local.conn = conn
+        return conn
+
+    def _reset_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, method, *args, **kwargs):
+        """Run a FaceRecognizer method on the pool and return its result
+
+        Raises:
+            InferencePoolBusy: If the pool is at its queue-depth limit
+            InferencePoolError: If the pool is unreachable, times out or the task fails
+        """
+        conn = self._connection()
+        try:
+            conn.send((method, args, kwargs))
+            if not conn.poll(self.timeout):
+                # The reply may still arrive later, so this connection can't be reused
+                self._reset_connection()
+                raise InferencePoolError(f"Inference pool did not answer within {self.timeout} seconds")
+            status, payload = conn.recv()
+        except (EOFError, OSError) as e:
+            self._reset_connection()
+            raise InferencePoolError(f"Lost connection to inference pool: {e}")
+
+        if status == 'busy':
+            raise InferencePoolBusy(f"Inference pool busy ({payload} requests in flight)")
+        if status == 'error':
+            raise InferencePoolError(payload)
+        return payload
+
+    def metrics(self):
+        """Return the recognizer metrics summed over the pool's workers"""
+        return self.call('metrics')
+
+    def __getattr__(self, name):
+        if name not in ALLOWED_METHODS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the face recognition inference pool')
+    parser.add_argument('--socket', default='/tmp/face-inference.sock', help='Unix socket path to listen on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--max-queue', type=int, default=64, help='Maximum requests in flight before answering busy')
+    parser.add_argument('--task-timeout', type=float, default=TASK_TIMEOUT, help='Seconds before a task is answered with an error')
+    args = parser.parse_args()
+
+    authkey = os.environ.get('INFERENCE_AUTHKEY')
+    if not authkey:
+        parser.error('INFERENCE_AUTHKEY must be set')
+
+    InferencePoolServer(args.socket, authkey.encode('utf-8'), workers=args.workers, max_queue_depth=args.max_queue,
+                        task_timeout=args.task_timeout).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""Gallery partitioned by student ID across shard servers, searched by scatter-gather
+
+Each shard server holds the encodings of the students that hash to it and
+answers top-k searches over its partition. A ShardCoordinator sends every
+search to all shards in parallel and merges their local top-k lists.
+
+Students are assigned with rendezvous (highest random weight) hashing, so when
+a shard is added or removed only the students that belong to it move.
+
+Shards talk over TCP sockets, so the same code runs as local processes on one
+machine or across several nodes. Every shard and the web app must share the
+authentication key in SHARD_AUTHKEY:
+
+    SHARD_AUTHKEY=secret python -m modules.sharding serve --listen 127.0.0.1:7001
+    SHARD_AUTHKEY=secret python -m modules.sharding serve --listen 127.0.0.1:7002
+    SHARD_AUTHKEY=secret GALLERY_SHARDS=127.0.0.1:7001,127.0.0.1:7002 python app.py
+
+or start N local shards at once with:
+
+    SHARD_AUTHKEY=secret python -m modules.sharding local --shards 4 --base-port 7001
+
+The web app only sends the students whose encodings changed. To add or remove a
+shard, start it, move the students between shards and then restart the app with
+the new GALLERY_SHARDS:
+
+    SHARD_AUTHKEY=secret GALLERY_SHARDS=127.0.0.1:7001,127.0.0.1:7002 python -m modules.sharding add-shard 127.0.0.1:7003
+    SHARD_AUTHKEY=secret GALLERY_SHARDS=127.0.0.1:7001,127.0.0.1:7002 python -m modules.sharding remove-shard 127.0.0.1:7002
+    SHARD_AUTHKEY=secret GALLERY_SHARDS=127.0.0.1:7001,127.0.0.1:7002 python -m modules.sharding rebalance
+"""
+import argparse
+import hashlib
+import heapq
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+
+def parse_address(address):
+    """Turn 'host:port' into a (host, port) tuple"""
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def shard_for(student_id, shards):
+    """Pick the shard that owns a student using rendezvous hashing"""
+    def weight(shard):
+        return hashlib.sha1(f"{shard}/{student_id}".encode('utf-8')).digest()
+    return max(shards, key=weight)
+
+
+def encodings_digest(encodings):
+    """Fingerprint of one student's encodings, used to find what changed"""
+    return hashlib.sha1(np.asarray(encodings, dtype=np.float64).reshape(-1, 128).tobytes()).hexdigest()
+
+
+class ShardServer:
+    """Holds one partition of the gallery and answers searches over it"""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._names = np.array([], dtype=str)
+        self._encodings = np.zeros((0, 128), dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def _set(self, names, encodings):
+        # Swap in new arrays at once so concurrent searches see a consistent snapshot
+        self._names = np.asarray(names, dtype=str)
+        self._encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+
+    def replace(self, names, encodings):
+        with self._lock:
+            self._set(names, encodings)
+        return len(names)
+
+    def add(self, names, encodings):
+        with self._lock:
+            self._set(
+                np.concatenate([self._names, np.asarray(names, dtype=str)]),
+                np.concatenate([self._encodings, np.asarray(encodings, dtype=np.float64).reshape(-1, 128)])
+            )
+        return len(names)
+
+    def remove(self, student_ids):
+        with self._lock:
+            keep = ~np.isin(self._names, [str(student_id) for student_id in student_ids])
+            self._set(self._names[keep], self._encodings[keep])
+        return int((~keep).sum())
+
+    def update(self, student_ids, names, encodings):
+        """Replace the encodings of the given students in one step"""
+        with self._lock:
+            keep = ~np.isin(self._names, [str(student_id) for student_id in student_ids])
+            self._set(
+                np.concatenate([self._names[keep], np.asarray(names, dtype=str)]),
+                np.concatenate([self._encodings[keep], np.asarray(encodings, dtype=np.float64).reshape(-1, 128)])
+            )
+        return len(names)
+
+    def export(self, student_ids=None):
+        """Return (names, encodings) for the given students, or for all of them"""
+        names, encodings = self._names, self._encodings
+        if student_ids is not None:
+            mask = np.isin(names, [str(student_id) for student_id in student_ids])
+            names, encodings = names[mask], encodings[mask]
+        return names.tolist(), encodings
+
+    def students(self):
+        return sorted(set(self._names.tolist()))
+
+    def digests(self):
+        """Return student_id -> encodings_digest for every student held"""
+        names, encodings = self._names, self._encodings
+        # A stable sort groups each student's rows without reordering them
+        order = np.argsort(names, kind='stable')
+        student_ids, starts = np.unique(names[order], return_index=True)
+        groups = np.split(encodings[order], starts[1:])
+        return {str(student_id): encodings_digest(group) for student_id, group in zip(student_ids, groups)}
+
+    def search(self, probes, k=1, roster=None):
+        """Return the local top-k (student_id, distance) list for each probe"""
+        names, encodings = self._names, self._encodings
+        if roster is not None:
+            mask = np.isin(names, [str(student_id) for student_id in roster])
+            names, encodings = names[mask], encodings[mask]
+
+        probes = np.asarray(probes, dtype=np.float64).reshape(-1, 128)
+        if len(encodings) == 0 or len(probes) == 0:
+            return [[] for _ in range(len(probes))]
+
+        squared = (
+            np.einsum('ij,ij->i', probes, probes)[:, None]
+            + np.einsum('ij,ij->i', encodings, encodings)[None, :]
+            - 2.0 * probes @ encodings.T
+        )
+        k = min(k, len(encodings))
+        top = np.argpartition(squared, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, columns in enumerate(top):
+            columns = columns[np.argsort(squared[row, columns])]
+            distances = np.sqrt(np.maximum(squared[row, columns], 0.0))
+            results.append([(str(names[c]), float(d)) for c, d in zip(columns, distances)])
+        return results
+
+    def stats(self):
+        return {'address': self.address, 'encodings': len(self._names), 'students': len(set(self._names.tolist()))}
+
+    def _handle_connection(self, conn):
+        operations = {
+            'replace': self.replace,
+            'add': self.add,
+            'remove': self.remove,
+            'update': self.update,
+            'export': self.export,
+            'students': self.students,
+            'digests': self.digests,
+            'search': self.search,
+            'stats': self.stats,
+        }
+        try:
+            while True:
+                try:
+                    operation, args = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    conn.send(('ok', operations[operation](*args)))
+                except Exception as e:
+                    conn.send(('error', f"{type(e).__name__}: {e}"))
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        listener = Listener(parse_address(self.address), authkey=self.authkey)
+        print(f"Gallery shard listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed authentication or a dropped handshake
+                    print(f"Rejected shard connection: {e}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+
+class ShardError(Exception):
+    """Raised when a shard cannot be reached or an operation on it fails"""
+
+
+class ShardCoordinator:
+    """Routes gallery updates to the owning shard and merges searches across all shards"""
+
+    def __init__(self, addresses, authkey):
+        self.authkey = authkey
+        self.addresses = list(addresses)
+        self._connections = {}
+        self._locks = {address: threading.Lock() for address in self.addresses}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.addresses)))
+
+    def _call(self, address, operation, *args):
+        """Run an operation on one shard, reconnecting once if the connection dropped"""
+        with self._locks[address]:
+            for attempt in range(2):
+                try:
+                    conn = self._connections.get(address)
+                    if conn is None:
+                        conn = Client(parse_address(address), authkey=self.authkey)
+                        self._connections[address] = conn
+                    conn.send((operation, args))
+                    status, payload = conn.recv()
+                    break
+                except (EOFError, OSError) as e:
+                    self._connections.pop(address, None)
+                    if attempt == 1:
+                        raise ShardError(f"Shard {address} unreachable: {e}")
+
+        if status == 'error':
+            raise ShardError(f"Shard {address} failed {operation}: {payload}")
+        return payload
+
+    def _scatter(self, operation, *args):
+        """Run the same operation on every shard in parallel"""
+        futures = [self._executor.submit(self._call, address, operation, *args) for address in self.addresses]
+        return [future.result() for future in futures]
+
+    def _partition(self, names, encodings):
+        parts = {address: ([], []) for address in self.addresses}
+        for name, encoding in zip(names, encodings):
+            part = parts[shard_for(name, self.addresses)]
+            part[0].append(str(name))
+            part[1].append(encoding)
+        return parts
+
+    def sync(self, names, encodings):
+        """Make the shards hold exactly the given gallery, sending only what changed
+
+        Each shard reports a digest of every student it holds. Only students
+        whose encodings differ are sent to their owning shard, and students a
+        shard should no longer hold (deleted, or owned by another shard since
+        the shard list changed) are removed afterwards, so searches never see
+        a gap.
+
+        Returns:
+            tuple: (students sent, students removed)
+        """
+        students = {}
+        for name, encoding in zip(names, encodings):
+            students.setdefault(str(name), []).append(encoding)
+        held = dict(zip(self.addresses, self._scatter('digests')))
+
+        updates = {address: ([], [], []) for address in self.addresses}
+        for student_id, student_encodings in students.items():
+            owner = shard_for(student_id, self.addresses)
+            if held[owner].get(student_id) != encodings_digest(student_encodings):
+                part = updates[owner]
+                part[0].append(student_id)
+                part[1].extend([student_id] * len(student_encodings))
+                part[2].extend(student_encodings)
+        futures = [
+            self._executor.submit(self._call, address, 'update', part[0], part[1], np.asarray(part[2]).reshape(-1, 128))
+            for address, part in updates.items() if part[0]
+        ]
+        for future in futures:
+            future.result()
+
+        removed = 0
+        for address, digests in held.items():
+            stale = [s for s in digests if s not in students or shard_for(s, self.addresses) != address]
+            if stale:
+                self._call(address, 'remove', stale)
+                removed += len(stale)
+        return sum(len(part[0]) for part in updates.values()), removed
+
+    def add(self, student_id, encodings):
+        """Add encodings for one student to the shard that owns it"""
+        address = shard_for(str(student_id), self.addresses)
+        return self._call(address, 'add', [str(student_id)] * len(encodings), np.asarray(encodings).reshape(-1, 128))
+
+    def search(self, probes, k=1, roster=None):
+        """Search every shard and merge the results
+
+        Returns:
+            list: For each probe, up to k (student_id, distance) pairs, closest first
+        """
+        if len(probes) == 0:
+            return []
+        roster = sorted(str(student_id) for student_id in roster) if roster else None
+        shard_results = self._scatter('search', np.asarray(probes, dtype=np.float64), k, roster)
+        return [
+            heapq.nsmallest(k, (match for result in shard_results for match in result[i]), key=lambda m: m[1])
+            for i in range(len(probes))
+        ]
+
+    def add_shard(self, address):
+        """Add a shard and move the students it now owns onto it"""
+        if address in self.addresses:
+            return
+        self._locks[address] = threading.Lock()
+        self.addresses.append(address)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.addresses))
+        self.rebalance()
+
+    def remove_shard(self, address):
+        """Drain a shard, hand its students to their new owners and drop it"""
+        names, encodings = self._call(address, 'export', None)
+        self.addresses.remove(address)
+        conn = self._connections.pop(address, None)
+        if conn is not None:
+            conn.close()
+
+        for owner, part in self._partition(names, encodings).items():
+            if part[0]:
+                self._call(owner, 'add', part[0], np.asarray(part[1]).reshape(-1, 128))
+
+    def rebalance(self):
+        """Move every student that is not on its owning shard
+
+        Encodings are added to the new owner before being removed from the old
+        one, so searches running meanwhile may see a duplicate but never a gap.
+        """
+        moved = 0
+        for address in list(self.addresses):
+            misplaced = [s for s in self._call(address, 'students') if shard_for(s, self.addresses) != address]
+            if not misplaced:
+                continue
+            names, encodings = self._call(address, 'export', misplaced)
+            for owner, part in self._partition(names, encodings).items():
+                if part[0]:
+                    self._call(owner, 'add', part[0], np.asarray(part[1]).reshape(-1, 128))
+            self._call(address, 'remove', misplaced)
+            moved += len(misplaced)
+        return moved
+
+    def stats(self):
+        return self._scatter('stats')
+
+
+def _serve(address, authkey):
+    ShardServer(address, authkey).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run and manage gallery shard servers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='Run one shard server')
+    serve.add_argument('--listen', required=True, help='host:port to listen on')
+
+    local = subparsers.add_parser('local', help='Run several shard servers as local processes')
+    local.add_argument('--shards', type=int, default=os.cpu_count() or 1)
+    local.add_argument('--host', default='127.0.0.1')
+    local.add_argument('--base-port', type=int, default=7001)
+
+    add_shard = subparsers.add_parser('add-shard', help='Move the students a new shard owns onto it')
+    add_shard.add_argument('address', help='host:port of the new, running shard')
+
+    remove_shard = subparsers.add_parser('remove-shard', help='Move all students off a shard')
+    remove_shard.add_argument('address', help='host:port of the shard to drain')
+
+    subparsers.add_parser('rebalance', help='Move every student onto the shard that owns it')
+
+    args = parser.parse_args()
+
+    authkey = os.environ.get('SHARD_AUTHKEY')
+    if not authkey:
+        parser.error('SHARD_AUTHKEY must be set')
+    authkey = authkey.encode('utf-8')
+
+    if args.command == 'serve':
+        _serve(args.listen, authkey)
+        return
+
+    if args.command in ('add-shard', 'remove-shard', 'rebalance'):
+        shards = [address for address in os.environ.get('GALLERY_SHARDS', '').split(',') if address]
+        if not shards:
+            parser.error('GALLERY_SHARDS must list the current shards')
+        coordinator = ShardCoordinator(shards, authkey)
+        if args.command == 'add-shard':
+            coordinator.add_shard(args.address)
+        elif args.command == 'remove-shard':
+            if args.address not in shards:
+                parser.error(f'{args.address} is not in GALLERY_SHARDS')
+            coordinator.remove_shard(args.address)
+        else:
+            print(f"Moved {coordinator.rebalance()} students")
+        print(f"GALLERY_SHARDS={','.join(coordinator.addresses)}")
+        return
+
+    addresses = [f'{args.host}:{args.base_port + i}' for i in range(args.shards)]
+    processes = [multiprocessing.Process(target=_serve, args=(address, authkey)) for address in addresses]
+    for process in processes:
+        process.start()
+    print(f"GALLERY_SHARDS={','.join(addresses)}")
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
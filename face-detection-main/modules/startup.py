@@ -0,0 +1,71 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupReport:
+    """Records how long each startup phase of the process took
+
+    Phases can nest (importing dlib happens while creating the recognizer), so
+    each phase records its depth and only top-level phases count towards the total.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _depth(self):
+        return getattr(self._local, 'depth', 0)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append({'name': name, 'seconds': round(seconds, 4), 'depth': self._depth()})
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a named phase"""
+        start_time = time.perf_counter()
+        self._local.depth = self._depth() + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            self.record(name, time.perf_counter() - start_time)
+
+    def as_dict(self):
+        with self._lock:
+            phases = list(self.phases)
+        return {
+            'phases': phases,
+            'total_seconds': round(sum(phase['seconds'] for phase in phases if phase['depth'] == 0), 4)
+        }
+
+# Shared by every module in the process
+startup_report = StartupReport()
+
+_import_lock = threading.Lock()
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access
+
+    Lets modules keep using e.g. ``cv2.imread`` while deferring the import (and,
+    for face_recognition, loading the dlib models) until something actually needs
+    it. The import time is recorded in startup_report.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        """Import the module now if it has not been imported yet"""
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    with startup_report.phase(f'import {self._name}'):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
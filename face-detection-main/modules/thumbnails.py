@@ -0,0 +1,141 @@
+import os
+import hashlib
+import threading
+from werkzeug.security import safe_join
+from modules.startup import LazyModule
+from modules.image_decode import decode_image_file, ImageDecodeError
+
+cv2 = LazyModule('cv2')
+
+class ThumbnailCache:
+    """Generates resized student images on demand and caches them on disk
+
+    Cached files are named after a hash of the source path, its size and
+    modification time and the thumbnail size, so an updated source image gets a
+    new entry (and a new ETag) while the stale one ages out. The cache is trimmed
+    to max_bytes by evicting the least recently used files.
+    """
+
+    def __init__(self, source_dir='data/student_images', cache_dir='data/thumbnails',
+                 sizes=(64, 128, 256), max_bytes=256 * 1024 * 1024, quality=85):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.sizes = sorted(sizes)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._total_bytes = None  # Computed lazily from the cache directory
+        self._lock = threading.Lock()
+
+    def choose_size(self, requested):
+        """Snap a requested size to the smallest configured size that covers it"""
+        for size in self.sizes:
+            if size >= requested:
+                return size
+        return self.sizes[-1]
+
+    def get(self, filename, size):
+        """Return the thumbnail for a student image, generating it if needed
+
+        Args:
+            filename: Path of the image relative to source_dir
+            size: Requested maximum width/height in pixels
+
+        Returns:
+            tuple: (path, etag) of the cached thumbnail
+
+        Raises:
+            FileNotFoundError: If the source image does not exist or cannot be decoded
+        """
+        source_path = safe_join(self.source_dir, filename)
+        if source_path is None or not os.path.isfile(source_path):
+            raise FileNotFoundError(filename)
+
+        size = self.choose_size(size)
+        stat = os.stat(source_path)
+        key = hashlib.sha1(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}:{size}".encode('utf-8')).hexdigest()
+        thumb_path = os.path.join(self.cache_dir, str(size), f'{key}.jpg')
+
+        if os.path.exists(thumb_path):
+            # Touch the file so it counts as recently used
+            try:
+                os.utime(thumb_path)
+            except OSError:
+                pass
+            return thumb_path, key
+
+        # Large JPEGs are decoded at reduced scale, no smaller than the thumbnail
+        try:
+            image = decode_image_file(source_path, max_side=size)
+        except ImageDecodeError:
+            raise FileNotFoundError(filename)
+
+        # Only ever shrink, preserving the aspect ratio
+        height, width = image.shape[:2]
+        scale = size / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise FileNotFoundError(filename)
+
+        # Write atomically so concurrent requests never serve a partial file
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        temp_path = f'{thumb_path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(temp_path, thumb_path)
+
+        self._account(len(encoded))
+        return thumb_path, key
+
+    def _scan(self):
+        """List (mtime, size, path) for every cached thumbnail"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith('.jpg'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _account(self, added_bytes):
+        """Track the cache size and evict least recently used files when over the limit"""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += added_bytes
+
+            if self._total_bytes <= self.max_bytes:
+                return
+
+            # Trim to 90% of the limit so eviction does not run on every write
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+    def clear(self):
+        """Drop every cached thumbnail"""
+        with self._lock:
+            for _, _, path in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes = 0
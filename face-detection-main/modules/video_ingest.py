@@ -0,0 +1,274 @@
+"""Attendance from recorded lecture videos
+
+A decode thread reads the video, keeps one frame every sample_every seconds and
+drops sampled frames that look the same as the last frame sent for
+recognition (a static slide or an empty room). The frames it keeps are
+recognized in parallel by a pool of worker processes. Every frame a student is
+recognized in counts as a vote, and students with at least min_votes votes
+are marked present in one bulk write at the end.
+
+Run from the project directory (the same place as app.py):
+
+    python -m modules.video_ingest lecture.mp4 --date 2024-09-02
+    python -m modules.video_ingest lecture.mp4 --section 3 --sample-every 2 --workers 8
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from modules.database import Database
+from modules.face_recognition import create_face_recognizer
+
+# Recognizer owned by each pool worker process, created once by _init_worker
+_worker_recognizer = None
+_worker_roster = None
+_worker_thorough = False
+
+
+def _init_worker(roster, thorough):
+    global _worker_recognizer, _worker_roster, _worker_thorough
+    # Configured like the inference pool's workers, so GALLERY_SHARDS applies here too
+    _worker_recognizer = create_face_recognizer(match_batching=False, trains=False)
+    _worker_roster = roster
+    _worker_thorough = thorough
+
+
+def _recognize_frame(item):
+    """Recognize the students in one sampled frame (runs in a worker process)"""
+    position, frame = item
+    try:
+        if _worker_thorough:
+            return position, _worker_recognizer.recognize_all_faces(frame, roster=_worker_roster)
+        return position, _worker_recognizer.recognize_faces(frame, roster=_worker_roster)
+    except Exception as e:
+        print(f"Error recognizing frame at {position:.1f}s: {e}")
+        return position, []
+
+
+class FrameSampler:
+    """Decodes a video on a background thread and queues the frames worth recognizing
+
+    Args:
+        path: Video file
+        sample_every: Seconds between sampled frames
+        scene_threshold: Mean absolute difference (0-255) of a small grayscale
+            thumbnail below which a sampled frame counts as unchanged and is skipped
+        max_gap: Seconds after which a frame is sent even if the scene is unchanged,
+            so students arriving in a static shot are still seen
+        max_side: Frames are downscaled to this size before being sent to the pool
+        queue_size: Frames buffered ahead of the recognizer pool
+    """
+
+    def __init__(self, path, sample_every=1.0, scene_threshold=4.0, max_gap=10.0, max_side=1024, queue_size=64):
+        self.path = path
+        self.sample_every = sample_every
+        self.scene_threshold = scene_threshold
+        self.max_gap = max_gap
+        self.max_side = max_side
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.duration = 0.0
+        self.stats = {'frames_decoded': 0, 'frames_sampled': 0, 'frames_unchanged': 0, 'frames_queued': 0}
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def __iter__(self):
+        """Yield (position_seconds, frame) until the video is exhausted"""
+        return iter(self.frames.get, None)
+
+    def _signature(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA).astype('int16')
+
+    def _run(self):
+        capture = cv2.VideoCapture(self.path)
+        try:
+            if not capture.isOpened():
+                raise IOError(f"Could not open video {self.path}")
+
+            fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+            frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+            self.duration = frame_count / fps if frame_count > 0 else 0.0
+            step = max(1, int(round(fps * self.sample_every)))
+
+            last_signature = None
+            last_queued = None
+            index = 0
+            while True:
+                # grab() skips colour conversion, so unsampled frames stay cheap
+                if not capture.grab():
+                    break
+                index += 1
+                self.stats['frames_decoded'] += 1
+                if (index - 1) % step:
+                    continue
+
+                ok, frame = capture.retrieve()
+                if not ok:
+                    continue
+                self.stats['frames_sampled'] += 1
+                position = (index - 1) / fps
+
+                signature = self._signature(frame)
+                if last_signature is not None and position - last_queued < self.max_gap:
+                    if abs(signature - last_signature).mean() < self.scene_threshold:
+                        self.stats['frames_unchanged'] += 1
+                        continue
+
+                height, width = frame.shape[:2]
+                if max(height, width) > self.max_side:
+                    scale = self.max_side / max(height, width)
+                    frame = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+                self.frames.put((position, frame))
+                self.stats['frames_queued'] += 1
+                last_signature = signature
+                last_queued = position
+
+            self.duration = max(self.duration, index / fps)
+        except Exception as e:
+            self.error = e
+        finally:
+            capture.release()
+            self.frames.put(None)
+
+
+class VoteTally:
+    """Counts the sampled frames each student was recognized in"""
+
+    def __init__(self):
+        self.votes = {}
+        self.first_seen = {}
+        self.frames = 0
+
+    def add(self, position, student_ids):
+        self.frames += 1
+        for student_id in set(student_ids):
+            self.votes[student_id] = self.votes.get(student_id, 0) + 1
+            if student_id not in self.first_seen or position < self.first_seen[student_id]:
+                self.first_seen[student_id] = position
+
+    def present(self, min_votes=2, min_fraction=0.0):
+        """Return the students with enough votes, by first appearance"""
+        needed = max(min_votes, min_fraction * self.frames)
+        return sorted((s for s, votes in self.votes.items() if votes >= needed), key=self.first_seen.get)
+
+
+def ingest_video(path, db, date=None, start_time=None, roster=None, workers=None, min_votes=2,
+                 min_fraction=0.0, thorough=False, **sampler_options):
+    """Compute attendance from a video file and record it in one bulk write
+
+    Args:
+        path: Video file
+        db: Database to record attendance in
+        date: Attendance date (YYYY-MM-DD). Defaults to the date of start_time.
+        start_time: datetime the recording started, used for attendance timestamps.
+            Defaults to the file modification time minus the video duration.
+        roster: Optional student IDs (e.g. a class section) to match against first
+        workers: Recognizer processes, defaults to the number of CPU cores
+        min_votes: Sampled frames a student must be recognized in to count as present
+        min_fraction: Alternatively, fraction of the recognized frames they must appear in
+        thorough: Crop and recognize each face separately (recognize_all_faces),
+            which finds more small faces but is slower
+        **sampler_options: Passed on to FrameSampler
+
+    Returns:
+        dict: Attendance written and processing statistics
+    """
+    started = time.time()
+    sampler = FrameSampler(path, **sampler_options)
+    tally = VoteTally()
+
+    # Spawn rather than fork the workers: the decode thread holds FFmpeg/OpenCV
+    # locks while it runs, and a child forked at that moment (including one the
+    # pool forks to replace a dead worker) can deadlock on them. The pool is also
+    # created before the decode thread starts.
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=workers or os.cpu_count() or 1, initializer=_init_worker,
+                      initargs=(roster, thorough)) as pool:
+        sampler.start()
+        for position, student_ids in pool.imap_unordered(_recognize_frame, sampler, chunksize=1):
+            tally.add(position, student_ids)
+
+    if sampler.error is not None:
+        raise sampler.error
+
+    if start_time is None:
+        start_time = datetime.datetime.fromtimestamp(os.path.getmtime(path)) - datetime.timedelta(seconds=sampler.duration)
+    date = date or start_time.date().isoformat()
+
+    present = tally.present(min_votes, min_fraction)
+    records = [
+        (int(student_id), date, (start_time + datetime.timedelta(seconds=tally.first_seen[student_id])).isoformat())
+        for student_id in present
+    ]
+    db.mark_attendance_bulk(records)
+
+    elapsed = time.time() - started
+    return {
+        'date': date,
+        'present': [int(student_id) for student_id in present],
+        'votes': {str(student_id): votes for student_id, votes in tally.votes.items()},
+        'video_seconds': round(sampler.duration, 1),
+        'elapsed_seconds': round(elapsed, 1),
+        'speedup': round(sampler.duration / elapsed, 1) if elapsed > 0 else 0.0,
+        **sampler.stats
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Take attendance from a recorded lecture video')
+    parser.add_argument('video', help='Video file')
+    parser.add_argument('--date', help='Attendance date (YYYY-MM-DD), defaults to the recording date')
+    parser.add_argument('--start', help='Recording start time (ISO format), defaults to file time minus duration')
+    parser.add_argument('--section', type=int, help='Class section whose roster is matched first')
+    parser.add_argument('--db', default='attendance_db.sqlite', help='SQLite database path')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Recognizer processes')
+    parser.add_argument('--sample-every', type=float, default=1.0, help='Seconds between sampled frames')
+    parser.add_argument('--scene-threshold', type=float, default=4.0,
+                        help='Skip sampled frames that differ less than this from the last one recognized (0 disables)')
+    parser.add_argument('--max-gap', type=float, default=10.0, help='Recognize at least one frame this often')
+    parser.add_argument('--min-votes', type=int, default=2, help='Frames a student must be recognized in')
+    parser.add_argument('--min-fraction', type=float, default=0.0, help='Fraction of frames a student must be recognized in')
+    parser.add_argument('--thorough', action='store_true', help='Recognize each detected face separately (slower)')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.video):
+        parser.error(f"{args.video} is not a file")
+
+    db = Database(args.db)
+    db.setup_database()
+    roster = db.get_section_roster(args.section) if args.section else None
+
+    result = ingest_video(
+        args.video, db,
+        date=args.date,
+        start_time=datetime.datetime.fromisoformat(args.start) if args.start else None,
+        roster=roster,
+        workers=args.workers,
+        min_votes=args.min_votes,
+        min_fraction=args.min_fraction,
+        thorough=args.thorough,
+        sample_every=args.sample_every,
+        scene_threshold=args.scene_threshold,
+        max_gap=args.max_gap
+    )
+
+    print(f"Processed {result['video_seconds']:.0f}s of video in {result['elapsed_seconds']:.0f}s "
+          f"({result['speedup']}x real time): {result['frames_sampled']} frames sampled, "
+          f"{result['frames_unchanged']} unchanged, {result['frames_queued']} recognized")
+    print(f"Marked {len(result['present'])} students present on {result['date']}: "
+          f"{', '.join(str(student_id) for student_id in result['present']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const capturedImage = document.getElementById('captured-image');
     const attendanceList = document.getElementById('attendance-list').querySelector('tbody');
     const dateInput = document.getElementById('attendance-date');
+    const sectionSelect = document.getElementById('attendance-section');
     const selectedDateSpan = document.getElementById('selected-date');
     const recognitionResult = document.getElementById('recognition-result');
     
@@ -18,12 +19,25 @@ document.addEventListener('DOMContentLoaded', function() {
     // Variables to store capture
     let imageCapture = null;
     
+    // Face detector instance, used to upload cropped face chips instead of the full frame
+    let faceDetector = null;
+    
     // Initialize camera
     if (navigator.mediaDevices && navigator.mediaDevices.getUserMedia) {
         navigator.mediaDevices.getUserMedia({ video: true })
             .then(function(stream) {
                 video.srcObject = stream;
                 video.play();
+                
+                // Initialize face detector once video is playing
+                video.onloadedmetadata = function() {
+                    const script = document.createElement('script');
+                    script.src = '/static/js/face-detector.js';
+                    script.onload = function() {
+                        faceDetector = new FaceDetector(video, null);
+                    };
+                    document.head.appendChild(script);
+                };
             })
             .catch(function(error) {
                 console.error("Camera error: ", error);
@@ -35,6 +49,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Load initial attendance data
     loadAttendanceData(dateInput.value);
+    loadSections();
     
     // Event listeners
     captureBtn.addEventListener('click', captureImage);
@@ -44,11 +59,21 @@ document.addEventListener('DOMContentLoaded', function() {
         loadAttendanceData(this.value);
     });
     
-    function captureImage() {
+    async function captureImage() {
         const context = canvas.getContext('2d');
         // Draw the video frame to the canvas
         context.drawImage(video, 0, 0, canvas.width, canvas.height);
         
+        // Crop the faces in the browser when the detector is ready
+        let chips = [];
+        if (faceDetector) {
+            try {
+                chips = await faceDetector.captureFaceChips(canvas);
+            } catch (error) {
+                console.error('Error cropping face chips:', error);
+            }
+        }
+        
         // Convert to base64
         imageCapture = canvas.toDataURL('image/jpeg');
         
@@ -60,8 +85,8 @@ document.addEventListener('DOMContentLoaded', function() {
         captureBtn.style.display = 'none';
         retakeBtn.style.display = 'inline-block';
         
-        // Process the image for attendance
-        processAttendance(imageCapture);
+        // Process the image for attendance, sending only the face chips if there are any
+        processAttendance(imageCapture, chips);
     }
     
     function retakeImage() {
@@ -77,14 +102,23 @@ document.addEventListener('DOMContentLoaded', function() {
         recognitionResult.innerHTML = '<p>Capture an image to mark attendance.</p>';
     }
     
-    function processAttendance(imageData) {
+    function processAttendance(imageData, chips = []) {
         // Show loading state
         recognitionResult.innerHTML = '<p>Processing attendance...</p>';
         
         // Create form data
         const formData = new FormData();
         formData.append('date', dateInput.value);
-        formData.append('image', imageData);
+        if (chips.length > 0) {
+            FaceDetector.appendFaceChips(formData, chips);
+        } else {
+            formData.append('image', imageData);
+        }
+        
+        // Match against the selected section's roster first
+        if (sectionSelect && sectionSelect.value) {
+            formData.append('section_id', sectionSelect.value);
+        }
         
         // Send to server
         fetch('/api/take_attendance', {
@@ -111,6 +145,26 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function loadSections() {
+        if (!sectionSelect) return;
+        
+        fetch('/api/classes')
+            .then(response => response.json())
+            .then(classes => {
+                classes.forEach(cls => {
+                    cls.sections.forEach(section => {
+                        const option = document.createElement('option');
+                        option.value = section.id;
+                        option.textContent = `${cls.name} - ${section.name}`;
+                        sectionSelect.appendChild(option);
+                    });
+                });
+            })
+            .catch(error => {
+                console.error('Error loading class sections:', error);
+            });
+    }
+    
     function loadAttendanceData(date) {
         fetch(`/api/attendance_data?date=${date}`)
             .then(response => response.json())
@@ -128,7 +182,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         const row = document.createElement('tr');
                         row.innerHTML = `
                             <td>${record.student_id}</td>
-                            <td>${record.name}</td>
+                            <td>${record.avatar ? `<img class="avatar" src="${record.avatar}" alt="" loading="lazy">` : ''}${record.name}</td>
                             <td>${formatTime(record.timestamp)}</td>
                         `;
                         attendanceList.appendChild(row);
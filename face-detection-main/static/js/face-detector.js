@@ -87,6 +87,63 @@ class FaceDetector {
         }
     }
     
+    /**
+     * Crop every face in the current video frame into a small JPEG chip
+     *
+     * Chips are scaled down so each face is at most faceSize pixels wide and
+     * returned with the face box inside the chip, ready to upload as binary
+     * files so the server can skip its own face detection.
+     */
+    async captureFaceChips(canvasElement, { maxFaces = 20, padding = 0.25, faceSize = 160, quality = 0.9 } = {}) {
+        await this.loadPromise;
+        
+        // Draw the full video frame to the canvas
+        const context = canvasElement.getContext('2d');
+        context.drawImage(this.video, 0, 0, canvasElement.width, canvasElement.height);
+        
+        const detections = await faceapi.detectAllFaces(
+            canvasElement,
+            new faceapi.TinyFaceDetectorOptions({ scoreThreshold: 0.5 })
+        );
+        
+        const chips = [];
+        for (const detection of detections.slice(0, maxFaces)) {
+            const box = detection.box;
+            const pad = Math.round(Math.max(box.width, box.height) * padding);
+            const x = Math.max(0, Math.round(box.x) - pad);
+            const y = Math.max(0, Math.round(box.y) - pad);
+            const width = Math.min(canvasElement.width - x, Math.round(box.width) + pad * 2);
+            const height = Math.min(canvasElement.height - y, Math.round(box.height) + pad * 2);
+            const scale = Math.min(1, faceSize / box.width);
+            
+            // Draw the padded face region onto a chip canvas, scaled down if needed
+            const chipCanvas = document.createElement('canvas');
+            chipCanvas.width = Math.round(width * scale);
+            chipCanvas.height = Math.round(height * scale);
+            chipCanvas.getContext('2d').drawImage(
+                canvasElement,
+                x, y, width, height,                         // Source rectangle
+                0, 0, chipCanvas.width, chipCanvas.height    // Destination rectangle
+            );
+            
+            const blob = await new Promise(resolve => chipCanvas.toBlob(resolve, 'image/jpeg', quality));
+            chips.push({
+                blob: blob,
+                box: [box.x - x, box.y - y, box.width, box.height].map(value => Math.round(value * scale))
+            });
+        }
+        
+        return chips;
+    }
+    
+    /**
+     * Add face chips to a form as 'face_chips' files and their boxes as 'face_boxes'
+     */
+    static appendFaceChips(formData, chips) {
+        chips.forEach((chip, i) => formData.append('face_chips', chip.blob, `chip_${i}.jpg`));
+        formData.append('face_boxes', JSON.stringify(chips.map(chip => chip.box)));
+    }
+    
     async captureFace(canvasElement, padding = 50) {
         try {
             await this.loadPromise;
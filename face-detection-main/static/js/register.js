@@ -19,6 +19,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Variables to track captured images
     let capturedImages = [];
+    let capturedChips = [];  // Face chips cropped in the browser: {blob, box, url}
     let uploadedFiles = [];
     
     // Face detector instance
@@ -86,7 +87,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     function updateRegisterButtonState() {
         // Enable register button if we have at least one image and a name
-        const hasImages = capturedImages.length > 0 || uploadedFiles.length > 0;
+        const hasImages = capturedImages.length > 0 || capturedChips.length > 0 || uploadedFiles.length > 0;
         const hasName = studentNameInput.value.trim() !== '';
         registerBtn.disabled = !(hasImages && hasName);
     }
@@ -96,13 +97,15 @@ document.addEventListener('DOMContentLoaded', function() {
         const context = canvas.getContext('2d');
         context.drawImage(video, 0, 0, canvas.width, canvas.height);
         
-        // If face detector is available, use it to crop the face
+        // If face detector is available, use it to crop the face into a chip
         if (faceDetector) {
-            const result = await faceDetector.captureFace(canvas);
+            const chips = await faceDetector.captureFaceChips(canvas, { maxFaces: 1 });
             
-            if (result.faceDetected) {
-                capturedImages.push(result.imageData);
-                addImageToPreview(result.imageData);
+            if (chips.length > 0) {
+                const chip = chips[0];
+                chip.url = URL.createObjectURL(chip.blob);
+                capturedChips.push(chip);
+                addImageToPreview(chip.url);
                 updateCaptureUI();
             } else {
                 alert('No face detected. Please ensure your face is clearly visible.');
@@ -158,6 +161,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 capturedImages.splice(index, 1);
             }
             
+            // Or from the captured face chips
+            const chipIndex = capturedChips.findIndex(chip => chip.url === imageSource);
+            if (chipIndex !== -1) {
+                URL.revokeObjectURL(imageSource);
+                capturedChips.splice(chipIndex, 1);
+            }
+            
             // Remove the container
             imageContainer.remove();
             
@@ -173,7 +183,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     function clearAllImages() {
         // Clear arrays
+        capturedChips.forEach(chip => URL.revokeObjectURL(chip.url));
         capturedImages = [];
+        capturedChips = [];
         uploadedFiles = [];
         
         // Clear preview container
@@ -187,7 +199,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     function updateCaptureUI() {
-        const totalImages = capturedImages.length + uploadedFiles.length;
+        const totalImages = capturedImages.length + capturedChips.length + uploadedFiles.length;
         captureCount.textContent = `Capture facial images (${totalImages} captured)`;
         
         // Update register button state
@@ -195,7 +207,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     function registerStudent() {
-        if (capturedImages.length === 0 && uploadedFiles.length === 0) {
+        if (capturedImages.length === 0 && capturedChips.length === 0 && uploadedFiles.length === 0) {
             alert('Please capture or upload at least one image.');
             return;
         }
@@ -211,7 +223,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // Create form data for checking duplicate face
         const checkFormData = new FormData();
-        if (capturedImages.length > 0) {
+        if (capturedChips.length > 0) {
+            FaceDetector.appendFaceChips(checkFormData, capturedChips.slice(0, 1));
+        } else if (capturedImages.length > 0) {
             checkFormData.append('image', capturedImages[0]);
         } else if (uploadedFiles.length > 0) {
             // For uploaded files, we'll need to send the first file
@@ -250,6 +264,11 @@ document.addEventListener('DOMContentLoaded', function() {
                 formData.append(`image_${i}`, capturedImages[i]);
             }
             
+            // Add face chips cropped in the browser as binary files
+            if (capturedChips.length > 0) {
+                FaceDetector.appendFaceChips(formData, capturedChips);
+            }
+            
             // Add uploaded files
             for (const file of uploadedFiles) {
                 formData.append('uploaded_images', file);
@@ -288,14 +307,14 @@ document.addEventListener('DOMContentLoaded', function() {
         // Ask user if they want to force a full retraining
         const forceRetrain = confirm(
             "Do you want to perform a full retraining of all students?\n\n" +
-            "NO = Train only new students that haven't been processed yet (faster)\n" +
+            "NO = Train only images added, changed or deleted since the last training (faster)\n" +
             "YES = Retrain all students from scratch (slower but may be more accurate)"
         );
         
         // Show loading state
         trainingStatus.textContent = forceRetrain ? 
             'Training full model... This may take a few minutes.' : 
-            'Training model for new students... This may take a moment.';
+            'Training model for new and changed images... This may take a moment.';
         trainingStatus.className = 'status-message';
         
         // Send training request with force_retrain parameter
@@ -0,0 +1,128 @@
+import struct
+from types import SimpleNamespace
+
+import pytest
+
+from modules import image_decode
+from modules.image_decode import read_header, _exif_orientation, _reduced_flag
+
+
+def exif_segment(orientation, endian='<'):
+    """Body of a JPEG APP1 segment holding one orientation tag"""
+    byte_order = b'II' if endian == '<' else b'MM'
+    tiff = byte_order + struct.pack(endian + 'HI', 42, 8)
+    tiff += struct.pack(endian + 'H', 1)
+    tiff += struct.pack(endian + 'HHIH', 0x0112, 3, 1, orientation) + b'\x00\x00'
+    tiff += struct.pack(endian + 'I', 0)
+    return b'Exif\x00\x00' + tiff
+
+
+def jpeg(width, height, orientation=None):
+    data = b'\xff\xd8'
+    # An unrelated APP0 segment before the ones that matter
+    data += b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    if orientation is not None:
+        segment = exif_segment(orientation)
+        data += b'\xff\xe1' + struct.pack('>H', len(segment) + 2) + segment
+    data += b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\x00' * 9
+    data += b'\xff\xda' + b'\x00' * 16
+    return data
+
+
+def test_read_header_jpeg():
+    assert read_header(jpeg(4000, 3000)) == ('jpeg', 4000, 3000, 1)
+
+
+def test_read_header_jpeg_with_exif_orientation():
+    assert read_header(jpeg(4000, 3000, orientation=6)) == ('jpeg', 4000, 3000, 6)
+
+
+def test_read_header_jpeg_progressive():
+    data = jpeg(640, 480).replace(b'\xff\xc0', b'\xff\xc2')
+    assert read_header(data) == ('jpeg', 640, 480, 1)
+
+
+def test_read_header_jpeg_without_frame_header():
+    assert read_header(b'\xff\xd8\xff\xda' + b'\x00' * 16) == ('jpeg', None, None, 1)
+
+
+def test_read_header_truncated_jpeg():
+    assert read_header(jpeg(640, 480)[:26]) == ('jpeg', None, None, 1)
+
+
+def test_read_header_accepts_memoryview():
+    assert read_header(memoryview(jpeg(800, 600, orientation=3))) == ('jpeg', 800, 600, 3)
+
+
+def test_read_header_png():
+    data = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 1920, 1080) + b'\x08\x02\x00\x00\x00'
+    assert read_header(data) == ('png', 1920, 1080, 1)
+
+
+def test_read_header_bmp_top_down():
+    data = b'BM' + b'\x00' * 16 + struct.pack('<ii', 640, -480) + b'\x00' * 28
+    assert read_header(data) == ('bmp', 640, 480, 1)
+
+
+def test_read_header_webp_lossy():
+    data = b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 10 + struct.pack('<HH', 800 | 0x4000, 600)
+    assert read_header(data) == ('webp', 800, 600, 1)
+
+
+def test_read_header_webp_lossless():
+    bits = (1024 - 1) | ((768 - 1) << 14)
+    data = b'RIFF\x00\x00\x00\x00WEBPVP8L' + b'\x00' * 4 + b'\x2f' + struct.pack('<I', bits)
+    assert read_header(data) == ('webp', 1024, 768, 1)
+
+
+def test_read_header_webp_extended():
+    data = b'RIFF\x00\x00\x00\x00WEBPVP8X' + b'\x00' * 8 + (1920 - 1).to_bytes(3, 'little') + (1080 - 1).to_bytes(3, 'little')
+    assert read_header(data) == ('webp', 1920, 1080, 1)
+
+
+def test_read_header_unknown_format():
+    assert read_header(b'GIF89a' + b'\x00' * 20) == (None, None, None, 1)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_exif_orientation(endian):
+    assert _exif_orientation(exif_segment(8, endian)) == 8
+
+
+def test_exif_orientation_not_exif():
+    assert _exif_orientation(b'http://ns.adobe.com/xap/1.0/\x00') == 1
+
+
+def test_exif_orientation_bad_byte_order():
+    assert _exif_orientation(b'Exif\x00\x00XX' + b'\x00' * 20) == 1
+
+
+def test_exif_orientation_truncated():
+    assert _exif_orientation(exif_segment(6)[:16]) == 1
+
+
+def test_exif_orientation_without_tag():
+    segment = exif_segment(6).replace(struct.pack('<H', 0x0112), struct.pack('<H', 0x010F))
+    assert _exif_orientation(segment) == 1
+
+
+@pytest.fixture
+def fake_cv2(monkeypatch):
+    flags = SimpleNamespace(IMREAD_COLOR=1, IMREAD_REDUCED_COLOR_2=2, IMREAD_REDUCED_COLOR_4=4,
+                            IMREAD_REDUCED_COLOR_8=8)
+    monkeypatch.setattr(image_decode, 'cv2', flags)
+    return flags
+
+
+@pytest.mark.parametrize('width, height, expected', [
+    (8192, 6144, 8),
+    (8191, 6144, 4),
+    (4096, 3072, 4),
+    (2048, 1536, 2),
+    (2047, 1536, 1),
+    (1024, 768, 1),
+    (640, 480, 1),
+    (3000, 5000, 4),
+])
+def test_reduced_flag_keeps_target_side(fake_cv2, width, height, expected):
+    assert _reduced_flag(width, height, 1024) == expected